@@ -1,18 +1,21 @@
 # jsonanalitst.py
 
 import json
+import threading
 import numpy as np
-from pyquaternion import Quaternion
-import matplotlib.path as mpath
 import math
 
 """
 jsonanalitst.py
 
 - analyze_json(input_json_path, user_height=170, verbose=False) -> dict
-  * input_json_path: 3D座標を含むJSON (frames -> coordinates -> {joint_name, x,y,z})
+  * input_json_path: 3D座標を含むJSON (frames -> coordinates -> {joint_name, x,y,z})、
+                     または姿勢推定の結果の .npz (poses: (T, 17, 3))
   * user_height: ユーザーの身長 (cm) (ペルソナから取得)
   * verbose: True なら debug print
+- analyze_poses(poses, user_height=170, verbose=False) -> dict
+  * poses: (T, 17, 3) の配列 (joint_names 順)。JSON を経由せずに同じ解析をする
+- StreamingAnalyzer(user_height=170): push(frame_xyz) でフレームを追加し、snapshot() で途中までの結果を返す
 
 返り値の dict 例:
 {
@@ -33,6 +36,7 @@ joint_names = [
     "LShoulder", "LElbow", "LWrist",
     "RShoulder", "RElbow", "RWrist"
 ]
+joint_index = {name: i for i, name in enumerate(joint_names)}
 
 # 体重比や質量中心比などのデータ
 center_of_gravity_data = [
@@ -92,9 +96,10 @@ center_of_gravity_data = [
 class fix:
     """
     身長に合わせた比率計算を行う
+    poses: (T, 17, 3) の3D座標 (joint_names 順)
     """
-    def __init__(self, skeleton_frames, user_height):
-        self.skeleton_frames = skeleton_frames
+    def __init__(self, poses, user_height):
+        self.poses = poses
         self.user_height = user_height
 
     def ratio(self):
@@ -102,14 +107,14 @@ class fix:
         0番フレームの "Head" と "LAnkle" のZ座標差を (self.user_height) で割って
         縮尺比を返す
         """
-
-        head = np.array(self.skeleton_frames[0]["Head"])
-        thorax = np.array(self.skeleton_frames[0]["Thorax"])
-        spine = np.array(self.skeleton_frames[0]["Spine"])
-        hip = np.array(self.skeleton_frames[0]["Hip"])
-        rhip = np.array(self.skeleton_frames[0]["RHip"])
-        rknee = np.array(self.skeleton_frames[0]["RKnee"])
-        rankle = np.array(self.skeleton_frames[0]["RAnkle"])
+        pose = self.poses[0]
+        head = pose[joint_index["Head"]]
+        thorax = pose[joint_index["Thorax"]]
+        spine = pose[joint_index["Spine"]]
+        hip = pose[joint_index["Hip"]]
+        rhip = pose[joint_index["RHip"]]
+        rknee = pose[joint_index["RKnee"]]
+        rankle = pose[joint_index["RAnkle"]]
 
         length1 = np.linalg.norm(head-thorax)
         length2 = np.linalg.norm(thorax-spine)
@@ -123,6 +128,55 @@ class fix:
         return tall / self.user_height
 
 
+def norms(vectors):
+    """
+    (..., 3) --> (...) の長さ。np.linalg.norm(v) と同じ内積カーネル (matmul) を使うので、
+    1フレームずつ計算した場合と丸めまで一致する
+    """
+    return np.sqrt((vectors[..., None, :] @ vectors[..., :, None])[..., 0, 0])
+
+
+# ******************** 回転 (四元数をまとめて計算) ********************
+# pyquaternion の Quaternion(axis=..., angle=...).rotate(v) を全フレーム分まとめて行う。
+# 積の行列・正規化の条件を同じにしているので結果も一致する
+
+def quaternion_matrix(q):
+    """(..., 4) の四元数 (w, x, y, z) --> 左から掛ける積の行列 (..., 4, 4)"""
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    return np.stack([
+        np.stack([w, -x, -y, -z], axis=-1),
+        np.stack([x,  w, -z,  y], axis=-1),
+        np.stack([y,  z,  w, -x], axis=-1),
+        np.stack([z, -y,  x,  w], axis=-1)
+    ], axis=-2)
+
+
+def quaternion_multiply(a, b):
+    """(..., 4) 同士の積 a * b"""
+    return (quaternion_matrix(a) @ b[..., :, None])[..., 0]
+
+
+def quaternion_from_axis_angle(axis, angle):
+    """(..., 3) の回転軸 (単位ベクトルでなくてもよい) と角度 [rad] --> (..., 4) の四元数"""
+    mag_sq = axis[..., None, :] @ axis[..., :, None]
+    mag_sq = mag_sq[..., 0]
+    axis = np.where(np.abs(1.0 - mag_sq) > 1e-12, axis / np.sqrt(mag_sq), axis)
+    theta = angle / 2.0
+    return np.concatenate([np.full(mag_sq.shape, math.cos(theta)), axis * math.sin(theta)], axis=-1)
+
+
+def rotate_vectors(q, vectors):
+    """(..., 4) の四元数で (..., 3) のベクトルを回転する (q v q*)。vectors は q に合わせてブロードキャストする"""
+    sum_sq = (q[..., None, :] @ q[..., :, None])[..., 0]
+    n = np.sqrt(sum_sq)
+    q = np.where((np.abs(1.0 - sum_sq) < 1e-14) | ~(n > 0), q, q / n)
+
+    vectors = np.broadcast_to(vectors, q.shape[:-1] + (3,))
+    v = np.concatenate([np.zeros(q.shape[:-1] + (1,)), vectors], axis=-1)
+    conjugate = q * np.array([1.0, -1.0, -1.0, -1.0])
+    return quaternion_multiply(quaternion_multiply(q, v), conjugate)[..., 1:]
+
+
 class center_of_gravity:
     @staticmethod
     def dataselect(gender, Kaup_index):
@@ -143,29 +197,32 @@ class center_of_gravity:
                 return 5
 
     @staticmethod
-    def segment(data_idx, point, weight, frame_num, skeleton_frames):
-        # skeleton_frames[frame_num] => dict { "Hip":(x,y,z), ... }
+    def segment(data_idx, point, weight, poses):
+        """
+        全フレームの各部位の重心をまとめて計算する
+        poses: (T, 17, 3), point: (T, 3) のインパクト位置 (strakezone.inpact_point)
+        戻り値: (T, 16, 3) [頭, 体幹, 上腕 L/R, 前腕 L/R, 手 L/R, 大腿 L/R, 下腿 L/R, 足 L/R, インパクト位置, 全身重心]
+        """
         # data_idx => center_of_gravity_dataの何番か
         data_block = center_of_gravity_data[data_idx]["data"]
         default_block = center_of_gravity_data[0]["data"]
 
-        hips_Position = np.array(skeleton_frames[frame_num]["Hip"])
-        r_upleg_Position = np.array(skeleton_frames[frame_num]["RHip"])
-        r_leg_Position = np.array(skeleton_frames[frame_num]["RKnee"])
-        r_foot_Position = np.array(skeleton_frames[frame_num]["RAnkle"])
-        l_upleg_Position = np.array(skeleton_frames[frame_num]["LHip"])
-        l_leg_Position = np.array(skeleton_frames[frame_num]["LKnee"])
-        l_foot_Position = np.array(skeleton_frames[frame_num]["LAnkle"])
-        Spine_Position = np.array(skeleton_frames[frame_num]["Spine"])
-        Thorax_Position = np.array(skeleton_frames[frame_num]["Thorax"])
-        neck_Position = np.array(skeleton_frames[frame_num]["Neck/Nose"])
-        head_Position = np.array(skeleton_frames[frame_num]["Head"])
-        l_arm_Position = np.array(skeleton_frames[frame_num]["LShoulder"])
-        l_forearm_Position = np.array(skeleton_frames[frame_num]["LElbow"])
-        l_hand_Position = np.array(skeleton_frames[frame_num]["LWrist"])
-        r_arm_Position = np.array(skeleton_frames[frame_num]["RShoulder"])
-        r_forearm_Position = np.array(skeleton_frames[frame_num]["RElbow"])
-        r_hand_Position = np.array(skeleton_frames[frame_num]["RWrist"])
+        hips_Position = poses[:, joint_index["Hip"]]
+        r_upleg_Position = poses[:, joint_index["RHip"]]
+        r_leg_Position = poses[:, joint_index["RKnee"]]
+        r_foot_Position = poses[:, joint_index["RAnkle"]]
+        l_upleg_Position = poses[:, joint_index["LHip"]]
+        l_leg_Position = poses[:, joint_index["LKnee"]]
+        l_foot_Position = poses[:, joint_index["LAnkle"]]
+        Thorax_Position = poses[:, joint_index["Thorax"]]
+        neck_Position = poses[:, joint_index["Neck/Nose"]]
+        head_Position = poses[:, joint_index["Head"]]
+        l_arm_Position = poses[:, joint_index["LShoulder"]]
+        l_forearm_Position = poses[:, joint_index["LElbow"]]
+        l_hand_Position = poses[:, joint_index["LWrist"]]
+        r_arm_Position = poses[:, joint_index["RShoulder"]]
+        r_forearm_Position = poses[:, joint_index["RElbow"]]
+        r_hand_Position = poses[:, joint_index["RWrist"]]
 
         # 頭
         head = (1 - data_block["質量中心比(%)"][0]/100)*head_Position + \
@@ -216,89 +273,98 @@ class center_of_gravity:
         cg = cg / (weight+0.9)
 
         G = [
-            head.tolist(), body.tolist(), l_uparm.tolist(), r_uparm.tolist(),
-            l_forearm_.tolist(), r_forearm_.tolist(), l_hand.tolist(), r_hand.tolist(),
-            l_upleg_.tolist(), r_upleg_.tolist(), l_leg_.tolist(), r_leg_.tolist(),
-            l_foot_.tolist(), r_foot_.tolist(), Inpactpoint.tolist(), cg.tolist()
+            head, body, l_uparm, r_uparm,
+            l_forearm_, r_forearm_, l_hand, r_hand,
+            l_upleg_, r_upleg_, l_leg_, r_leg_,
+            l_foot_, r_foot_, Inpactpoint, cg
         ]
-        return G
+        return np.stack(G, axis=1)
 
 
 class strakezone:
 
     @staticmethod
-    def inpact_point(i, skeleton_frames, ratio):
+    def inpact_point(poses, ratio):
+        """全フレームのインパクト位置 (T, 3)。右手首から前腕に垂直な方向へバットの長さ分ずらした点"""
         # RHand & RElbow => オフセット
-        R_hand = np.array(skeleton_frames[i]["RWrist"])
-        R_elbow = np.array(skeleton_frames[i]["RElbow"])
+        R_hand = poses[:, joint_index["RWrist"]]
+        R_elbow = poses[:, joint_index["RElbow"]]
         direction_vector = R_hand - R_elbow
-        norm_val = np.linalg.norm(direction_vector)
-        if norm_val<1e-6:
-            return R_hand
-        direction_unit = direction_vector / norm_val
-        up_vector = np.array([0,1,0])
-        perp = np.cross(direction_unit, up_vector)
-        if np.linalg.norm(perp)<1e-6:
-            up_vector = np.array([1,0,0])
+        norm_val = norms(direction_vector)[:, None]
+
+        # 手首と肘が重なっているフレーム (norm_val<1e-6) は最後に R_hand に置き換える
+        with np.errstate(divide='ignore', invalid='ignore'):
+            direction_unit = direction_vector / norm_val
+            up_vector = np.array([0,1,0])
             perp = np.cross(direction_unit, up_vector)
-        perp = perp / np.linalg.norm(perp)
-        rotation_axis = np.cross(perp, direction_unit)
-        rotation_axis = rotation_axis / np.linalg.norm(rotation_axis)
-        angle = np.pi / 2
-        q = Quaternion(axis=rotation_axis, angle=angle)
-        offset = np.array([0,70*ratio,0])  # 簡易
-        rotated = q.rotate(offset)
+            # 前腕が y 軸と平行なフレームは x 軸を使う
+            up_vector = np.array([1,0,0])
+            perp = np.where(norms(perp)[:, None]<1e-6, np.cross(direction_unit, up_vector), perp)
+            perp = perp / norms(perp)[:, None]
+            rotation_axis = np.cross(perp, direction_unit)
+            rotation_axis = rotation_axis / norms(rotation_axis)[:, None]
+
+            angle = np.pi / 2
+            q = quaternion_from_axis_angle(rotation_axis, angle)
+            offset = np.array([0,70*ratio,0])  # 簡易
+            rotated = rotate_vectors(q, offset)
         InpactPoint = R_hand + rotated
-        return InpactPoint
+        return np.where(norm_val<1e-6, R_hand, InpactPoint)
 
-        
+    @staticmethod
+    def zone_polygon(zone):
+        """zone = [minX, minY, minZ, maxX, maxY, maxZ] --> ストライクゾーンの五角形 (x, y) の頂点 (5, 2)"""
+        return np.array([
+            [zone[3], zone[4]],
+            [zone[3], zone[1]],
+            [0, zone[4]],
+            [0, zone[1]],
+            [zone[0], (zone[4]+zone[1])/2]
+        ], dtype=np.float64)
 
     @staticmethod
-    def is_inside_pentagonal_prism(point, zone):
-        x,y,z = point
-        if not(zone[2] <= z <= zone[5]):
-            return False
-        vertices = [
-            np.array([zone[3], zone[4]]),
-            np.array([zone[3], zone[1]]),
-            np.array([0, zone[4]]),
-            np.array([0, zone[1]]),
-            np.array([zone[0], (zone[4]+zone[1])/2])
-        ]
-        path = mpath.Path(vertices)
-        return path.contains_point((x,y))
+    def is_inside_pentagonal_prism(points, zone):
+        """
+        points: (T, 3) --> (T,) bool。z が [minZ, maxZ] の範囲内で、(x, y) が五角形の内側か
+        五角形は閉じた多角形として交差数の偶奇で判定する (matplotlib の Path.contains_point と同じ判定・境界の扱い)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        x, y, z = points[:, :1], points[:, 1:2], points[:, 2]
+
+        # 各辺 (x0, y0) -> (x1, y1) と +x 方向の半直線の交差を全点・全辺まとめて調べる
+        vertices = strakezone.zone_polygon(zone)
+        x0, y0 = vertices[:, 0], vertices[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+        above0, above1 = y0 >= y, y1 >= y
+        crossing = (above0 != above1) & (((y1 - y) * (x0 - x1) >= (x1 - x) * (y0 - y1)) == above1)
+        inside = np.logical_xor.reduce(crossing, axis=1)
+
+        return inside & (zone[2] <= z) & (z <= zone[5])
 
     @staticmethod
-    def calc_strike_judge(num_frames, skeleton_frames, zone, ratio):
-        jlist = []
-        for i in range(num_frames):
-            p = strakezone.inpact_point(i, skeleton_frames, ratio)
-            inside = strakezone.is_inside_pentagonal_prism(p, zone)
-            jlist.append(inside)
-        return jlist
+    def calc_strike_judge(points, zone):
+        """points: (T, 3) のインパクト位置 --> 各フレームでストライクゾーン内か (bool のリスト)"""
+        return strakezone.is_inside_pentagonal_prism(points, zone).tolist()
 
     @staticmethod
-    def batspeed(ratio,skeleton_frames):
-        speed_list = []
-        Inpact_list = []
-        for i in range(len(skeleton_frames)-1):
-            p_now = strakezone.inpact_point(i, skeleton_frames,ratio)
-            Inpact_list.append(p_now)
-
-            if p_now[1]>0:
-                p_next = strakezone.inpact_point(i+1, skeleton_frames, ratio)
-                speed = (p_next - p_now)/ratio/0.0333
-                speed = np.linalg.norm(speed)
-                speed = speed/100000*3600
-                speed_list.append(speed)  
-            else:
-                speed_list.append(0)
+    def speeds(ratio, points):
+        """
+        points: (T, 3) のインパクト位置。フレーム i と i+1 の差から速度 (km/h) を求める (i < T-1)
+        インパクト位置が y<=0 のフレームは 0
+        """
+        speeds = norms((points[1:] - points[:-1])/ratio/0.0333)
+        speeds = speeds/100000*3600
+        return [speed if moving else 0 for speed, moving in zip(speeds.tolist(), points[:-1, 1] > 0)]
 
+    @staticmethod
+    def batspeed(ratio, points):
+        """(最大速度, 各フレームの速度, 最大となるフレーム) (speeds を参照)"""
+        speed_list = strakezone.speeds(ratio, points)
 
         max_speed = max(speed_list)
         max_idx = speed_list.index(max_speed)
         return max_speed, speed_list, max_idx
-    
+
 
 # ********************** 分析関数 *************************
 
@@ -306,6 +372,7 @@ def analyze_json(input_json_path, user_height=170,  verbose=False):
     """
     JSON(3D座標)を読み込み:
     frames: [ { frame_index, coordinates: [{joint_name, x,y,z}, ...] }, ... ]
+    (.npz の場合は poses: (T, 17, 3) を読む)
     user_height: ペルソナ情報にある身長（cm）
     verbose: Trueなら旧来のprintデバッグを出す
 
@@ -318,97 +385,155 @@ def analyze_json(input_json_path, user_height=170,  verbose=False):
         "max_speed_index": int
     }
     """
-    with open(input_json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    frames_data = data["frames"]
-    skeleton_frames = []
-    for fr in frames_data:
-        # fr: { "frame_index": int, "coordinates": [ {joint_name, x,y,z}, ... ] }
-        coords_list = fr["coordinates"]
-        d = {}
-        for c in coords_list:
+    if input_json_path.endswith('.npz'):
+        with np.load(input_json_path) as archive:
+            poses = archive["poses"]
+    else:
+        with open(input_json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        poses = []
+        for fr in data["frames"]:
+            # fr: { "frame_index": int, "coordinates": [ {joint_name, x,y,z}, ... ] }
             # joint_names に無いキーが来たら無視
-            if c["joint_name"] in joint_names:
-                d[c["joint_name"]] = (c["x"], c["y"], c["z"])
-        skeleton_frames.append(d)
-
+            d = {c["joint_name"]: (c["x"], c["y"], c["z"]) for c in fr["coordinates"]}
+            poses.append([d[name] for name in joint_names])
+        poses = np.array(poses, dtype=np.float64).reshape(-1, len(joint_names), 3)
 
-    total_frames = len(skeleton_frames)
     if verbose:
-        print(f"[JsonAnalist] loaded {total_frames} frames from {input_json_path}")
-
-    # fix + ratio
-    fix_obj = fix(skeleton_frames, user_height)
-    ratio_val = fix_obj.ratio()
-    #print(ratio_val)
-
-
-    # ストライクゾーン設定 => minX, minY, minZ, maxX, maxY, maxZ
-    # (例) 0番フレームの LShoulder, Hip, LKnee から計算
-    # -> ここでは腕を変えるなど適宜
-    # 簡易にmilk
-    # 例: maxZ = (shoulderZ + hipZ)/2, ...
-    # ここで "170固定" だったところを ratio_val でスケール
-    # or 既存コードの strakezoneを活用
-    # 省略し、calc_strike_judge呼ぶ前に "zone = [..]" とする
-    # => 既存ロジック踏襲
-
-    # 今回は strakezoneクラスには "zone" 設定関数がないので
-    #   => "calc_strike_judge" に zoneを与えるには自前で zoneを作る必要あり
-    # もともと fix.ratio(170) していた -> fix_obj.ratio() する
-    # 省略
-
-    minX = -21.6 * ratio_val
-    maxX = 21.6 * ratio_val
-    minY = 76.15* ratio_val
-    maxY = 119.35* ratio_val
-    # zは 0番フレーム "LKnee" or "Hip" から引っ張る
-    # 例:
-    lShoulderZ = skeleton_frames[0]["LShoulder"][2]
-    hipZ = skeleton_frames[0]["Hip"][2]
-    kneeZ = skeleton_frames[0]["LKnee"][2]
-    maxZ = (lShoulderZ + hipZ)/2
-    minZ = kneeZ
-
-    zone = [minX, minY, minZ, maxX, maxY, maxZ]
-
-    # 性別, Kaup適当
-    data_idx = center_of_gravity.dataselect('man', 1.88)
-
-    # 全フレーム重心
-    gravity_list = []
-    for i in range(total_frames):
-        ip = strakezone.inpact_point(i, skeleton_frames,ratio_val)
-        seg = center_of_gravity.segment(data_idx, ip, 70, i, skeleton_frames)
-        gravity_list.append(seg[15])  # 全身重心
-
-    # judge
-    judge_list = strakezone.calc_strike_judge(total_frames, skeleton_frames, zone, ratio_val)
-    # speed
-    spd, spd_list, max_idx = strakezone.batspeed(ratio_val, skeleton_frames)
-    #print(spd)
-    #print(spd_list)
-    #print(max_idx)
+        print(f"[JsonAnalist] loaded {len(poses)} frames from {input_json_path}")
+    return analyze_poses(poses, user_height, verbose)
+
+
+def analyze_poses(poses, user_height=170, verbose=False):
+    """
+    analyze_json と同じ解析を (T, 17, 3) の配列 (joint_names 順, 例: pose_io.load_poses のメモリマップ) に対して行う。
+    全フレームをまとめて計算する (StreamingAnalyzer に一度に push するのと同じ)
+    """
+    analyzer = StreamingAnalyzer(user_height)
+    analyzer.push(poses)
+    result = analyzer.snapshot()
 
     if verbose:
         print("===========================================")
-        print(f"User height = {user_height}, ratio= {ratio_val}")
-        print(f"Gravity list = {gravity_list}")
-        print(f"judge list= {judge_list}")
-        print(f"speed= {spd}, speed_list= {spd_list}, len= {len(spd_list)}, max_index= {max_idx}")
-
-    result = {
-        "idealgravity": gravity_list,
-        "judge": judge_list,
-        "speed": spd,
-        "speed_list": spd_list,
-        "speed_list_len": len(spd_list),
-        "max_speed_index": max_idx
-    }
+        print(f"User height = {user_height}, ratio= {analyzer.ratio}")
+        print(f"Gravity list = {result['idealgravity']}")
+        print(f"judge list= {result['judge']}")
+        print(f"speed= {result['speed']}, speed_list= {result['speed_list']}, len= {result['speed_list_len']}, "
+              f"max_index= {result['max_speed_index']}")
+
     return result
 
 
+class StreamingAnalyzer:
+    """
+    フレームが届くごとに解析を進める (3D推定の途中から結果を出す、長い動画で途中経過を表示する など)
+
+        analyzer = StreamingAnalyzer(user_height=170)
+        analyzer.push(frame_xyz)     # (17, 3) の1フレーム、または (n, 17, 3) のまとまり
+        analyzer.snapshot()          # それまでのフレームに対する analyze_poses と同じ形式の結果
+
+    縮尺比とストライクゾーンは最初のフレームだけで決まる (fix.ratio) ので、後から届くフレームで変わらない。
+    全フレームを push した後の snapshot は analyze_poses の結果と一致する。
+    バット速度はフレーム i と i+1 から求めるため、最後のフレームの速度は次のフレームが届いた時に加わる
+    (2フレーム未満の間は speed / max_speed_index は None)。
+    push と snapshot は別スレッドから呼んでもよい (stream_pose3D の on_chunk など)。
+    """
+    def __init__(self, user_height=170):
+        self.user_height = user_height
+        self.ratio = None
+        self.zone = None
+        # 性別, Kaup適当
+        self.data_idx = center_of_gravity.dataselect('man', 1.88)
+
+        self.num_frames = 0
+        self.gravity_list = []
+        self.judge_list = []
+        self.speed_list = []
+        self.max_speed = None
+        self.max_speed_index = None
+        self._last_point = None
+        self._lock = threading.Lock()
+
+    def _start(self, pose):
+        """最初のフレーム (17, 3) から縮尺比とストライクゾーンを決める"""
+        # fix + ratio
+        self.ratio = fix(pose[None], self.user_height).ratio()
+
+        # ストライクゾーン設定 => minX, minY, minZ, maxX, maxY, maxZ
+        # (例) 0番フレームの LShoulder, Hip, LKnee から計算
+        # -> ここでは腕を変えるなど適宜
+        # 簡易にmilk
+        # 例: maxZ = (shoulderZ + hipZ)/2, ...
+        # ここで "170固定" だったところを self.ratio でスケール
+        # or 既存コードの strakezoneを活用
+        # 省略し、calc_strike_judge呼ぶ前に "zone = [..]" とする
+        # => 既存ロジック踏襲
+
+        # 今回は strakezoneクラスには "zone" 設定関数がないので
+        #   => "calc_strike_judge" に zoneを与えるには自前で zoneを作る必要あり
+        # もともと fix.ratio(170) していた -> fix_obj.ratio() する
+        # 省略
+
+        minX = -21.6 * self.ratio
+        maxX = 21.6 * self.ratio
+        minY = 76.15* self.ratio
+        maxY = 119.35* self.ratio
+        # zは 0番フレーム "LKnee" or "Hip" から引っ張る
+        # 例:
+        lShoulderZ = pose[joint_index["LShoulder"], 2]
+        hipZ = pose[joint_index["Hip"], 2]
+        kneeZ = pose[joint_index["LKnee"], 2]
+        maxZ = (lShoulderZ + hipZ)/2
+        minZ = kneeZ
+
+        self.zone = [minX, minY, minZ, maxX, maxY, maxZ]
+
+    def push(self, frame_xyz):
+        """frame_xyz: (17, 3) または (n, 17, 3) の3D座標 (joint_names 順)。直前までのフレームの続き"""
+        poses = np.asarray(frame_xyz, dtype=np.float64).reshape(-1, len(joint_names), 3)
+        if not len(poses):
+            return self
+        if self.ratio is None:
+            self._start(poses[0])
+
+        # 全フレーム重心・判定はフレームごとに独立なので届いた分だけ計算する
+        points = strakezone.inpact_point(poses, self.ratio)
+        gravity = center_of_gravity.segment(self.data_idx, points, 70, poses)[:, 15].tolist()
+        judge = strakezone.calc_strike_judge(points, self.zone)
+
+        # 速度は前回の最後のフレームから続けて求める
+        if self._last_point is not None:
+            points = np.concatenate([self._last_point[None], points])
+        speeds = strakezone.speeds(self.ratio, points)
+
+        with self._lock:
+            self.gravity_list.extend(gravity)
+            self.judge_list.extend(judge)
+            if speeds:
+                # 同じ最大値なら先のフレームのまま (list.index と同じ)
+                max_speed = max(speeds)
+                if self.max_speed is None or max_speed > self.max_speed:
+                    self.max_speed = max_speed
+                    self.max_speed_index = len(self.speed_list) + speeds.index(max_speed)
+            self.speed_list.extend(speeds)
+            self._last_point = points[-1]
+            self.num_frames += len(poses)
+        return self
+
+    def snapshot(self):
+        """push 済みのフレームに対する解析結果 (analyze_json と同じキー)"""
+        with self._lock:
+            return {
+                "idealgravity": list(self.gravity_list),
+                "judge": list(self.judge_list),
+                "speed": self.max_speed,
+                "speed_list": list(self.speed_list),
+                "speed_list_len": len(self.speed_list),
+                "max_speed_index": self.max_speed_index
+            }
+
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
@@ -1,4 +1,5 @@
 from torch import nn
+import torch.nn.functional as F
 
 
 class Attention(nn.Module):
@@ -8,7 +9,12 @@ class Attention(nn.Module):
     """
 
     def __init__(self, dim_in, dim_out, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0.,
-                 mode='spatial'):
+                 mode='spatial', fused=True):
+        """
+        :param fused: use F.scaled_dot_product_attention, which does not keep the full attention map in memory,
+                      whenever attention dropout is inactive. False always takes the explicit softmax(q k^T) v path
+                      (see set_fused_attention to switch a whole model)
+        """
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim_in // num_heads
@@ -17,6 +23,7 @@ class Attention(nn.Module):
         self.attn_drop = nn.Dropout(attn_drop)
         self.proj = nn.Linear(dim_in, dim_out)
         self.mode = mode
+        self.fused = fused
         self.qkv = nn.Linear(dim_in, dim_in * 3, bias=qkv_bias)
         self.proj_drop = nn.Dropout(proj_drop)
 
@@ -37,8 +44,20 @@ class Attention(nn.Module):
         x = self.proj_drop(x)
         return x
 
+    def use_fused(self):
+        return self.fused and (not self.training or self.attn_drop.p == 0)
+
+    def fused_attention(self, q, k, v):
+        """(B, H, N, L, C) --> same shape; batch dims are merged because the flash CPU kernel only takes 4D input"""
+        x = F.scaled_dot_product_attention(q.flatten(0, 1), k.flatten(0, 1), v.flatten(0, 1), scale=self.scale)
+        return x.view(q.shape)
+
     def forward_spatial(self, q, k, v):
         B, H, T, J, C = q.shape
+        if self.use_fused():
+            x = self.fused_attention(q, k, v)  # (B, H, T, J, C)
+            return x.permute(0, 2, 3, 1, 4).reshape(B, T, J, C * self.num_heads)
+
         attn = (q @ k.transpose(-2, -1)) * self.scale  # (B, H, T, J, J)
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -53,6 +72,10 @@ class Attention(nn.Module):
         kt = k.transpose(2, 3)  # (B, H, J, T, C)
         vt = v.transpose(2, 3)  # (B, H, J, T, C)
 
+        if self.use_fused():
+            x = self.fused_attention(qt, kt, vt)  # (B, H, J, T, C)
+            return x.permute(0, 3, 2, 1, 4).reshape(B, T, J, C * self.num_heads)
+
         attn = (qt @ kt.transpose(-2, -1)) * self.scale  # (B, H, J, T, T)
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -60,3 +83,11 @@ class Attention(nn.Module):
         x = attn @ vt  # (B, H, J, T, C)
         x = x.permute(0, 3, 2, 1, 4).reshape(B, T, J, C * self.num_heads)
         return x  # (B, T, J, C)
+
+
+def set_fused_attention(model, fused):
+    """switch every Attention in `model` between the fused and the explicit path, e.g. to compare their outputs"""
+    for module in model.modules():
+        if isinstance(module, Attention):
+            module.fused = fused
+    return model
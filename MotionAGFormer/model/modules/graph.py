@@ -40,6 +40,9 @@ class GCN(nn.Module):
 
         if mode == 'spatial':
             self.adj = self._init_spatial_adj()
+            # the skeleton never changes: normalize once, forward() broadcasts it over all B*T graphs.
+            # Not persistent, so checkpoints without it still load with strict=True
+            self.register_buffer('norm_adj', self.normalize_digraph(self.adj.unsqueeze(0))[0], persistent=False)
         elif mode == 'temporal' and not self.use_temporal_similarity:
             self.adj = self._init_temporal_adj(temporal_connection_len)
 
@@ -86,12 +89,35 @@ class GCN(nn.Module):
 
         return norm_adj
 
-    def change_adj_device_to_cuda(self, adj):
-        dev = self.V.weight.get_device()
+    @staticmethod
+    def change_adj_device_to_cuda(adj, x):
+        # device of the input rather than of self.V.weight, which is a method on dynamically quantized Linear
+        dev = x.get_device()
         if dev >= 0 and adj.get_device() < 0:
             adj = adj.to(dev)
         return adj
 
+    def aggregate_top_k(self, x, values):
+        """
+        Temporal similarity graph without a dense (N, T, T) adjacency: every frame is connected to its
+        `neighbour_num` most similar frames, so all degrees equal k and D^-1/2 A D^-1/2 reduces to averaging
+        the k gathered rows of `values`.
+        A tie at the k-th similarity connects a frame to more than k frames; the dense graph is built only then.
+        x: (N, T, C) node features, values: (N, T, C') = V(x)
+        """
+        n, t, _ = x.shape
+        k = self.neighbour_num
+        similarity = x @ x.transpose(1, 2)
+        top_values, indices = similarity.topk(k=min(k + 1, t), dim=-1, largest=True)
+        if t > k and (top_values[..., k] == top_values[..., k - 1]).any():
+            adj = (similarity >= top_values[..., k - 1:k]).float()
+            return self.normalize_digraph(adj) @ values
+
+        # flat row indices into values.reshape(N * T, C')
+        indices = indices[..., :k] + (torch.arange(n, device=x.device) * t).view(n, 1, 1)
+        neighbours = values.reshape(n * t, -1).index_select(0, indices.reshape(-1))
+        return neighbours.view(n, t, k, -1).mean(dim=2)
+
     def forward(self, x):
         """
         x: tensor with shape [B, T, J, C]
@@ -101,22 +127,15 @@ class GCN(nn.Module):
             x = x.transpose(1, 2)  # (B, T, J, C) -> (B, J, T, C)
             x = x.reshape(-1, t, c)
             if self.use_temporal_similarity:
-                similarity = x @ x.transpose(1, 2)
-                threshold = similarity.topk(k=self.neighbour_num, dim=-1, largest=True)[0][..., -1].view(b * j, t, 1)
-                adj = (similarity >= threshold).float()
+                aggregate = self.aggregate_top_k(x, self.V(x))
             else:
                 adj = self.adj
-                adj = self.change_adj_device_to_cuda(adj)
+                adj = self.change_adj_device_to_cuda(adj, x)
                 adj = adj.repeat(b * j, 1, 1)
-
+                aggregate = self.normalize_digraph(adj) @ self.V(x)
         else:
             x = x.reshape(-1, j, c)
-            adj = self.adj
-            adj = self.change_adj_device_to_cuda(adj)
-            adj = adj.repeat(b * t, 1, 1)
-
-        norm_adj = self.normalize_digraph(adj)
-        aggregate = norm_adj @ self.V(x)
+            aggregate = self.norm_adj @ self.V(x)  # (J, J), broadcast over the B*T graphs
 
         if self.dim_in == self.dim_out:
             x = self.relu(x + self.batch_norm(aggregate + self.U(x)))
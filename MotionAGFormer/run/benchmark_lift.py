@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from vis import load_pose3D_model, lift_pose3D, FLIP_MODES
+from MotionAGFormer.model.modules.attention import set_fused_attention
+
+"""
+benchmark_lift.py
+
+flip TTA の各モード (off / on / batched) の持ち上げ時間と、on を基準にした3D座標の差を比較する。
+続けて attention の計算方法 (従来の softmax(q k^T) v / scaled_dot_product_attention) も同様に比較する。
+
+    python MotionAGFormer/run/benchmark_lift.py --keypoints ./run/output/<video>/input_2D/keypoints.npz
+
+--keypoints を省略した場合はランダムな2Dキーポイント (--frames フレーム) で時間だけを測る。
+"""
+
+
+def mpjpe(a, b):
+    """mean per-joint position error between two (T, 17, 3) sequences"""
+    return float(np.mean(np.linalg.norm(a - b, axis=-1)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keypoints', type=str, default=None, help='input_2D/keypoints.npz written by vis.py')
+    parser.add_argument('--frames', type=int, default=243, help='Number of random frames without --keypoints')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--checkpoint', type=str, default='MotionAGFormer/checkpoint')
+    parser.add_argument('--batch', type=int, default=8, help='MotionAGFormer sequences per forward pass')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.keypoints:
+        keypoints = np.load(args.keypoints, allow_pickle=True)['reconstruction']
+    else:
+        keypoints = np.random.rand(1, args.frames, 17, 3).astype(np.float32) * [args.width, args.height, 1]
+    img_size = (args.height, args.width)
+
+    model = load_pose3D_model(args.checkpoint)
+    lift_pose3D(keypoints[:, :243], model, img_size, flip='off')  # warm up
+
+    results = {}
+    for flip in FLIP_MODES:
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[flip] = lift_pose3D(keypoints, model, img_size, batch_size=args.batch, flip=flip)
+            times.append(time.perf_counter() - start)
+        results[flip + '_time'] = min(times)
+
+    reference = results['on']
+    print(f"frames: {keypoints.shape[1]}, batch: {args.batch}, best of {args.repeat}")
+    print(f"{'flip':<8} {'time [s]':>9} {'speedup':>8} {'MPJPE vs on':>12}")
+    for flip in FLIP_MODES:
+        speedup = results['on_time'] / results[flip + '_time']
+        print(f"{flip:<8} {results[flip + '_time']:>9.3f} {speedup:>7.2f}x {mpjpe(results[flip], reference):>12.5f}")
+
+    outputs, best = {}, {}
+    for name, fused in (('explicit', False), ('fused', True)):
+        set_fused_attention(model, fused)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            outputs[name] = lift_pose3D(keypoints, model, img_size, batch_size=args.batch)
+            times.append(time.perf_counter() - start)
+        best[name] = min(times)
+
+    print(f"{'attention':<9} {'time [s]':>9} {'speedup':>8} {'MPJPE vs explicit':>18}")
+    for name in ('explicit', 'fused'):
+        speedup = best['explicit'] / best[name]
+        print(f"{name:<9} {best[name]:>9.3f} {speedup:>7.2f}x {mpjpe(outputs[name], outputs['explicit']):>18.5f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+
+def show2Dpose(kps, img):
+    connections = [[0, 1], [1, 2], [2, 3], [0, 4], [4, 5],
+                   [5, 6], [0, 7], [7, 8], [8, 9], [9, 10],
+                   [8, 11], [11, 12], [12, 13], [8, 14], [14, 15], [15, 16]]
+
+    LR = np.array([0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0], dtype=bool)
+
+    lcolor = (255, 0, 0)
+    rcolor = (0, 0, 255)
+    thickness = 3
+
+    for j,c in enumerate(connections):
+        start = map(int, kps[c[0]])
+        end = map(int, kps[c[1]])
+        start = list(start)
+        end = list(end)
+        cv2.line(img, (start[0], start[1]), (end[0], end[1]), lcolor if LR[j] else rcolor, thickness)
+        cv2.circle(img, (start[0], start[1]), thickness=-1, color=(0, 255, 0), radius=3)
+        cv2.circle(img, (end[0], end[1]), thickness=-1, color=(0, 255, 0), radius=3)
+
+    return img
+
+
+class FFmpegWriter(object):
+    """
+    Pipes raw BGR frames into a single ffmpeg process that encodes H.264 (yuv420p, +faststart), so the
+    result plays in the browser as is. Falls back to cv2.VideoWriter (mp4v) when ffmpeg is not installed.
+    """
+    def __init__(self, path, fps, size, crf=23, preset='veryfast'):
+        self.path = path
+        self.size = size  # (width, height), both even for yuv420p
+        self.h264 = shutil.which('ffmpeg') is not None
+
+        if self.h264:
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}', '-r', str(fps), '-i', '-',
+                   '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+                   '-movflags', '+faststart', path]
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            print('ffmpeg not found, writing mp4v with cv2.VideoWriter instead of H.264.')
+            self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+    def write(self, frame):
+        if self.h264:
+            self._proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        else:
+            self._writer.write(frame)
+
+    def close(self):
+        if self.h264:
+            self._proc.stdin.close()
+            err = self._proc.stderr.read()
+            if self._proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg encoding failed: {err.decode(errors='replace')}")
+        else:
+            self._writer.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def crop_square(img):
+    # center crop of landscape frames, like the original demo
+    if img.shape[0] < img.shape[1]:
+        edge = (img.shape[1] - img.shape[0]) // 2
+        img = img[:, edge:(img.shape[1] - edge)]
+    # portrait (phone) frames keep their aspect ratio on a white background, as imshow showed them
+    elif img.shape[0] > img.shape[1]:
+        pad = img.shape[0] - img.shape[1]
+        img = cv2.copyMakeBorder(img, 0, 0, pad // 2, pad - pad // 2, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+    return img
+
+
+def panel_2d(kpts, frame, size):
+    """2D overlay drawn on the frame, made square by crop_square and resized to a (size, size) panel"""
+    return cv2.resize(crop_square(show2Dpose(kpts, frame)), (size, size), interpolation=cv2.INTER_AREA)
+
+
+class PanelSpool(object):
+    """
+    Encoded 2D panels by frame index (get_pose2D(panels=...) --> render_video(panels=...)), stored in a
+    SpooledTemporaryFile: in memory up to max_memory_mb, in a temporary file beyond that, so that the panels
+    of a long video do not grow the process memory until rendering.
+    """
+    def __init__(self, max_memory_mb=256):
+        self._file = tempfile.SpooledTemporaryFile(max_size=int(max_memory_mb * 2 ** 20))
+        self._index = {}  # frame index -> (offset, length)
+
+    def __setitem__(self, index, data):
+        data = np.ascontiguousarray(data, dtype=np.uint8)
+        offset = self._file.seek(0, 2)
+        self._file.write(data.data)
+        self._index[index] = (offset, data.nbytes)
+
+    def __getitem__(self, index):
+        offset, length = self._index[index]
+        self._file.seek(offset)
+        return np.frombuffer(self._file.read(length), dtype=np.uint8)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Skeleton3DRenderer(object):
+    """
+    Draws the 3D skeleton with cv2 into a reusable canvas, reproducing the former matplotlib view
+    (elev=15, azim=70, +-0.72 x/y and +-0.7 z around the root, default 4:4:3 box) with an orthographic camera.
+    project() maps all frames to pixels in one vectorized step, draw() only rasterizes 16 lines.
+    """
+    I = np.array([0, 0, 1, 4, 2, 5, 0, 7, 8,  8, 14, 15, 11, 12, 8,  9])
+    J = np.array([1, 4, 2, 5, 3, 6, 7, 8, 14, 11, 15, 16, 12, 13, 9, 10])
+    LR = np.array([0, 1, 0, 1, 0, 1, 0, 0, 0, 1,  0,  0,  1,  1, 0, 0], dtype=bool)
+
+    lcolor = (255, 0, 0)  # BGR of matplotlib (0, 0, 1)
+    rcolor = (0, 0, 255)
+    grid_color = (225, 225, 225)
+    edge_color = (140, 140, 140)
+
+    radius = np.array([0.72, 0.72, 0.7])
+    box_aspect = np.array([4., 4., 3.]) / 4.
+
+    def __init__(self, size, elev=15., azim=70.):
+        self.size = size
+        self.thickness = max(2, int(round(size / 270.)))
+
+        elev, azim = np.deg2rad(elev), np.deg2rad(azim)
+        right = [-np.sin(azim), np.cos(azim), 0.]
+        up = [-np.sin(elev) * np.cos(azim), -np.sin(elev) * np.sin(azim), np.cos(elev)]
+        self.view = np.array([right, up]).T  # (3, 2)
+
+        # fit the projected box into the canvas
+        corners = np.array(np.meshgrid([-1, 1], [-1, 1], [-1, 1], indexing='ij')).reshape(3, -1).T
+        corners_2d = (corners * self.box_aspect) @ self.view
+        self.scale = 0.9 * size / (corners_2d.max(0) - corners_2d.min(0)).max()
+        self.offset = size / 2. - self.scale * (corners_2d.max(0) + corners_2d.min(0)) / 2. * [1, -1]
+
+        self.background = self._draw_background()
+        self.canvas = self.background.copy()
+
+    def _to_pixels(self, normalized):
+        """(..., 3) coordinates in the [-1, 1] box --> (..., 2) pixel coordinates"""
+        xy = (normalized * self.box_aspect) @ self.view
+        return np.rint(xy * self.scale * [1, -1] + self.offset).astype(np.int32)
+
+    def _draw_background(self):
+        img = np.full((self.size, self.size, 3), 255, dtype=np.uint8)
+        ticks = np.linspace(-1, 1, 7)
+
+        # grid on the floor and on the two back panes, seen from azim=70 these are z=-1, x=-1 and y=-1
+        lines = []
+        for t in ticks:
+            lines += [[(t, -1, -1), (t, 1, -1)], [(-1, t, -1), (1, t, -1)],
+                      [(-1, t, -1), (-1, t, 1)], [(-1, -1, t), (-1, 1, t)],
+                      [(t, -1, -1), (t, -1, 1)], [(-1, -1, t), (1, -1, t)]]
+        for p, q in self._to_pixels(np.array(lines, dtype=np.float64)):
+            cv2.line(img, tuple(p), tuple(q), self.grid_color, 1, cv2.LINE_AA)
+
+        edges = [[(-1, -1, -1), (1, -1, -1)], [(1, -1, -1), (1, 1, -1)], [(-1, -1, -1), (-1, 1, -1)],
+                 [(-1, 1, -1), (1, 1, -1)], [(-1, -1, -1), (-1, -1, 1)], [(-1, 1, -1), (-1, 1, 1)],
+                 [(1, -1, -1), (1, -1, 1)]]
+        for p, q in self._to_pixels(np.array(edges, dtype=np.float64)):
+            cv2.line(img, tuple(p), tuple(q), self.edge_color, 1, cv2.LINE_AA)
+        return img
+
+    def project(self, poses):
+        """(T, 17, 3) world coordinates --> (T, 17, 2) int pixels, each frame centred on its root joint"""
+        poses = np.asarray(poses, dtype=np.float64)
+        return self._to_pixels((poses - poses[:, :1]) / self.radius)
+
+    def draw(self, points):
+        """points: one frame of project(), returns the reused canvas (copy it to keep the image)"""
+        self.canvas[:] = self.background
+        for i, j, left in zip(self.I, self.J, self.LR):
+            cv2.line(self.canvas, tuple(points[i]), tuple(points[j]), self.lcolor if left else self.rcolor,
+                     self.thickness, cv2.LINE_AA)
+        return self.canvas
+
+    def render(self, pose):
+        return self.draw(self.project(pose[None])[0])
+
+
+class DemoCompositor(object):
+    """
+    Composes demo frames in memory and streams them to FFmpegWriter, no intermediate images are written.
+    mode='full': "Input" (2D overlay) | "Reconstruction" (3D skeleton), mode='preview': the 2D panel only
+    poses_3d: (T, 17, 3), projected for all frames up front in full mode
+    """
+    header = 40
+
+    def __init__(self, path, fps, panel_size=540, mode='full', poses_3d=None):
+        self.mode = mode
+        self.panel_size = panel_size - panel_size % 2
+        width = self.panel_size * (2 if mode == 'full' else 1)
+        height = self.panel_size + (self.header if mode == 'full' else 0)
+
+        self.writer = FFmpegWriter(path, fps, (width, height))
+        self.renderer_3d = None
+        if mode == 'full':
+            self.renderer_3d = Skeleton3DRenderer(self.panel_size)
+            self.points_3d = self.renderer_3d.project(poses_3d)
+
+        # reusable output frame, the titles never change
+        self.canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+        if mode == 'full':
+            for i, title in enumerate(("Input", "Reconstruction")):
+                (w, h), _ = cv2.getTextSize(title, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+                org = (i * self.panel_size + (self.panel_size - w) // 2, (self.header + h) // 2)
+                cv2.putText(self.canvas, title, org, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2, cv2.LINE_AA)
+
+    def write(self, panel, index=None):
+        """panel: output of panel_2d, index: frame of poses_3d to draw next to it (full mode)"""
+        if self.mode == 'full':
+            top = self.header
+            self.canvas[top:, :self.panel_size] = panel
+            self.canvas[top:, self.panel_size:] = self.renderer_3d.draw(self.points_3d[index])
+        else:
+            self.canvas[:] = panel
+        self.writer.write(self.canvas)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -27,11 +27,14 @@ model_dir = 'MotionAGFormer/run/lib/checkpoint/'
 
 # Loading human detector model
 from lib.yolov3.human_detector import load_model as yolo_model
-from lib.yolov3.human_detector import yolo_human_det as yolo_det
+from lib.yolov3.human_detector import detect_batch as yolo_det_batch
+from lib.yolov3.human_detector import arg_parse as yolo_arg_parse
 from lib.sort.sort import Sort
+from lib.prefetch import FramePrefetcher
+from lib.quantize import check_variant, variant_path, load_hrnet_int8
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Train keypoints network')
     # general
     parser.add_argument('--cfg', type=str, default=cfg_dir + 'w48_384x288_adam_lr1e-3.yaml',
@@ -51,7 +54,7 @@ def parse_args():
     parser.add_argument("-v", "--video", type=str, default='camera',
                         help="input video file name")
     parser.add_argument('--gpu', type=str, default='0', help='input video')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
@@ -65,8 +68,13 @@ def reset_config(args):
     torch.backends.cudnn.enabled = cfg.CUDNN.ENABLED
 
 
-def model_load(config):
+def model_load(config, variant='fp32'):
+    """variant: fp32 (the checkpoint) / int8 (converted by quantize_models.py, CPU only)"""
+    check_variant(variant)
     model = pose_hrnet.get_pose_net(config, is_train=False)
+    if variant == 'int8':
+        return load_hrnet_int8(model, variant_path(config.OUTPUT_DIR, variant))
+
     if torch.cuda.is_available():
         model = model.cuda()
 
@@ -85,40 +93,154 @@ def model_load(config):
     return model
 
 
-def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False):
+def load_models(det_dim=416, argv=None, variant='fp32'):
+    """
+    Load YOLOv3 and HRNet once so they can be reused across videos.
+    Pass argv=[] when calling in-process so that sys.argv is not parsed.
+    variant: HRNet weights, see model_load
+    """
     # Updating configuration
-    args = parse_args()
+    args = parse_args(argv)
     reset_config(args)
 
-    cap = cv2.VideoCapture(video)
+    human_model = yolo_model(args=yolo_arg_parse(argv), inp_dim=det_dim)
+    pose_model = model_load(cfg, variant)
+
+    return human_model, pose_model
+
+
+def pose_batch(pose_model, inputs, centers, scales):
+    """
+    Run HRNet once over all person patches gathered from (possibly several) frames.
+    inputs: list of (n_i, 3, H, W) tensors, centers / scales: one entry per patch
+    """
+    with torch.no_grad():
+        # the int8 HRNet runs on the CPU (it has no float parameters), the fp32 one wherever its weights are
+        device = next(pose_model.parameters(), torch.empty(0)).device
+        inputs = torch.cat(inputs).to(device)
+        output = pose_model(inputs)
+
+        # compute coordinate
+        preds, maxvals = get_final_preds(cfg, output.clone().cpu().numpy(), np.asarray(centers), np.asarray(scales))
+
+    return preds, maxvals
+
+
+def kpts_to_bbox(kpts, width, height, margin=0.15):
+    """
+    Box [x1, y1, x2, y2] around one person's keypoints (17, 2), padded by `margin` of the box size on every
+    side and clipped to the image.
+    """
+    x1, y1 = np.min(kpts, axis=0)
+    x2, y2 = np.max(kpts, axis=0)
+    pad_w = (x2 - x1) * margin
+    pad_h = (y2 - y1) * margin
+
+    bbox = [max(x1 - pad_w, 0), max(y1 - pad_h, 0), min(x2 + pad_w, width - 1), min(y2 + pad_h, height - 1)]
+    return [round(float(i), 2) for i in bbox]
+
+
+def iter_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False, models=None, thred_score=0.30,
+                    batch_size=1, det_batch_size=1, det_stride=1, kpt_thresh=0.3, track_kpts=False,
+                    track_margin=0.15, prefetch_depth=32, decode_width=None, stats=None, on_frame=None):
+    """
+    Yields (frame_index, kpts (num_peroson, 17, 2), scores (num_peroson, 17)) for every frame with a person,
+    in order and as soon as HRNet has processed it, so that long videos can be consumed in bounded chunks.
+    The keypoints are in the original resolution. gen_video_kpts collects the whole video.
+
+    batch_size: number of person patches (from consecutive frames) passed to HRNet in one forward pass
+    det_batch_size: number of frames passed to YOLOv3 in one forward pass
+    det_stride: run YOLOv3 on every `det_stride`-th frame and propagate the boxes with the SORT Kalman
+                predictor in between
+    kpt_thresh: when the mean HRNet confidence of a frame falls below this value, the next frame whose box
+                is still undecided is detected again (with batch_size > 1 this lags by up to one batch)
+    track_kpts: single-person tracking mode. YOLOv3 only seeds the first crop; every following crop is the
+                previous frame's keypoint box padded by `track_margin`, and YOLOv3 runs again only when the
+                mean confidence falls below `kpt_thresh`. Each frame depends on the previous one, so HRNet
+                runs frame by frame and batch_size / det_stride are ignored.
+    prefetch_depth: number of frames decoded ahead by the background decode thread
+    decode_width: optional width the frames are downscaled to (keeping the aspect ratio) while decoding;
+                  the keypoints are scaled back to the original resolution
+    stats: optional dict that receives the VideoInfo (when iteration starts) and the decoder metrics (queue
+           depth, stall times, once the video is done)
+    on_frame: optional callback on_frame(ii, frame, kpts, scores) called once per frame as soon as its
+              keypoints are known, so that other consumers (e.g. overlays) reuse this decode pass. frame and
+              kpts are in the decoded resolution (see decode_width)
+    """
+    reader = FramePrefetcher(video, max_queue=prefetch_depth)
+    if decode_width and decode_width < reader.width:
+        reader.resize = (decode_width, int(round(reader.height * decode_width / reader.width)))
+    if stats is not None:
+        stats['info'] = reader.info
+
+    # keypoints back to the original resolution
+    kpts_scale = None
+    if reader.resize is not None:
+        kpts_scale = np.array([reader.width / reader.resize[0], reader.height / reader.resize[1]], dtype=np.float32)
 
     # Loading detector and pose model, initialize sort for track
-    human_model = yolo_model(inp_dim=det_dim)
-    pose_model = model_load(cfg)
+    if models is None:
+        models = load_models(det_dim)
+    human_model, pose_model = models
     people_sort = Sort(min_hits=0)
 
-    video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    kpts_result = []
-    scores_result = []
-    for ii in tqdm(range(video_length)):
-        ret, frame = cap.read()
-
-        if not ret:
-            continue
-
-        bboxs, scores = yolo_det(frame, human_model, reso=det_dim, confidence=args.thred_score)
-
-        if bboxs is None or not bboxs.any():
-            print('No person detected!')
-            bboxs = bboxs_pre
-            scores = scores_pre
+    # frames whose keypoints are known but not yielded yet
+    ready = []
+
+    # patches waiting for the next HRNet forward pass
+    pending_inputs, pending_centers, pending_scales, pending_counts, pending_frames = [], [], [], [], []
+
+    def flush():
+        nonlocal force_detect, last_preds
+        if not pending_counts:
+            return
+        preds, maxvals = pose_batch(pose_model, pending_inputs, pending_centers, pending_scales)
+        last_preds = preds[-pending_counts[-1]:]
+        if (det_stride > 1 or track_kpts) and np.mean(maxvals[-pending_counts[-1]:]) < kpt_thresh:
+            force_detect = True
+
+        start = 0
+        for count, (ii, frame) in zip(pending_counts, pending_frames):
+            kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
+            scores = np.zeros((num_peroson, 17), dtype=np.float32)
+            for i, kpt in enumerate(preds[start:start + count]):
+                kpts[i] = kpt
+
+            for i, score in enumerate(maxvals[start:start + count]):
+                scores[i] = score.squeeze()
+
+            if on_frame is not None:
+                on_frame(ii, frame, kpts, scores)
+            ready.append((ii, kpts * kpts_scale if kpts_scale is not None else kpts, scores))
+            start += count
+
+        pending_inputs.clear()
+        pending_centers.clear()
+        pending_scales.clear()
+        pending_counts.clear()
+        pending_frames.clear()
+
+    bboxs_pre, scores_pre = None, None
+    force_detect = False
+    last_preds = None  # keypoints of the most recent frame that went through HRNet
+
+    def process(ii, frame, bboxs, scores, propagate=False):
+        nonlocal bboxs_pre, scores_pre
+
+        if propagate:
+            # Kalman prediction instead of a detection
+            people_track = people_sort.predict()
         else:
-            bboxs_pre = copy.deepcopy(bboxs) 
-            scores_pre = copy.deepcopy(scores) 
+            if bboxs is None or not bboxs.any():
+                print('No person detected!')
+                bboxs = bboxs_pre
+                scores = scores_pre
+            else:
+                bboxs_pre = copy.deepcopy(bboxs) 
+                scores_pre = copy.deepcopy(scores) 
 
-        # Using Sort to track people
-        people_track = people_sort.update(bboxs)
+            # Using Sort to track people
+            people_track = people_sort.update(bboxs)
 
         # Track the first two people in the video and remove the ID
         if people_track.shape[0] == 1:
@@ -127,34 +249,86 @@ def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False):
             people_track_ = people_track[-num_peroson:, :-1].reshape(num_peroson, 4)
             people_track_ = people_track_[::-1]
         else:
-            continue
+            return
 
         track_bboxs = []
         for bbox in people_track_:
             bbox = [round(i, 2) for i in list(bbox)]
             track_bboxs.append(bbox)
 
-        with torch.no_grad():
-            # bbox is coordinate location
-            inputs, origin_img, center, scale = PreProcess(frame, track_bboxs, cfg, num_peroson)
-
-            inputs = inputs[:, [2, 1, 0]]
-
-            if torch.cuda.is_available():
-                inputs = inputs.cuda()
-            output = pose_model(inputs)
-
-            # compute coordinate
-            preds, maxvals = get_final_preds(cfg, output.clone().cpu().numpy(), np.asarray(center), np.asarray(scale))
-
-        kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
-        scores = np.zeros((num_peroson, 17), dtype=np.float32)
-        for i, kpt in enumerate(preds):
-            kpts[i] = kpt
-
-        for i, score in enumerate(maxvals):
-            scores[i] = score.squeeze()
-
+        queue_patches(ii, frame, track_bboxs)
+
+    def queue_patches(ii, frame, track_bboxs):
+        # bbox is coordinate location
+        inputs, origin_img, center, scale = PreProcess(frame, track_bboxs, cfg, num_peroson)
+
+        pending_inputs.append(inputs[:, [2, 1, 0]])
+        pending_centers.extend(center)
+        pending_scales.extend(scale)
+        pending_counts.append(len(center))
+        pending_frames.append((ii, frame if on_frame is not None else None))
+
+        if sum(pending_counts) >= batch_size:
+            flush()
+
+    def detect_and_process(frames):
+        nonlocal force_detect
+
+        # key frames are known in advance and detected together
+        key_frames = [] if track_kpts else [frame for ii, frame in frames if ii % det_stride == 0]
+        detections = iter(yolo_det_batch(key_frames, human_model, reso=det_dim, confidence=thred_score))
+
+        for ii, frame in frames:
+            if track_kpts:
+                if last_preds is None or force_detect:
+                    bboxs, scores = yolo_det_batch([frame], human_model, reso=det_dim, confidence=thred_score)[0]
+                    force_detect = False
+                    process(ii, frame, bboxs, scores)
+                else:
+                    height, width = frame.shape[:2]
+                    queue_patches(ii, frame, [kpts_to_bbox(kpts, width, height, track_margin) for kpts in last_preds])
+                # the next crop needs this frame's keypoints
+                flush()
+            elif ii % det_stride == 0:
+                bboxs, scores = next(detections)
+                force_detect = False
+                process(ii, frame, bboxs, scores)
+            elif force_detect or not people_sort.tracked():
+                bboxs, scores = yolo_det_batch([frame], human_model, reso=det_dim, confidence=thred_score)[0]
+                force_detect = False
+                process(ii, frame, bboxs, scores)
+            else:
+                process(ii, frame, None, None, propagate=True)
+        frames.clear()
+
+    def drain():
+        yield from ready
+        ready.clear()
+
+    frames = []
+    with reader:
+        for ii, frame in tqdm(reader, total=reader.num_frames):
+            frames.append((ii, frame))
+            if len(frames) >= det_batch_size * det_stride:
+                detect_and_process(frames)
+                yield from drain()
+
+        detect_and_process(frames)
+        flush()
+        yield from drain()
+
+    if stats is not None:
+        stats.update(reader.metrics())
+
+
+def gen_video_kpts(video, num_peroson=1, **kwargs):
+    """
+    Keypoints and scores of the whole video: (num_peroson, T, 17, 2), (num_peroson, T, 17).
+    See iter_video_kpts for the arguments.
+    """
+    kpts_result = []
+    scores_result = []
+    for ii, kpts, scores in iter_video_kpts(video, num_peroson=num_peroson, **kwargs):
         kpts_result.append(kpts)
         scores_result.append(scores)
 
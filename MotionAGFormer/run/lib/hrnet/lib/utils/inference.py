@@ -13,9 +13,8 @@ import sys
 import os.path as osp
 import numpy as np
 
-sys.path.insert(0, osp.join(osp.dirname(osp.realpath(__file__)), '..'))
-from utils.transforms import transform_preds
-sys.path.pop(0)
+# the repo-level `utils` package shadows this namespace package when imported in-process
+from lib.hrnet.lib.utils.transforms import transform_preds
 
 
 def get_max_preds(batch_heatmaps):
@@ -0,0 +1,244 @@
+import os
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+
+# H36M joint order of the 3D output (JsonAnalist.joint_names is the same)
+JOINT_NAMES = [
+    "Hip", "RHip", "RKnee", "RAnkle",
+    "LHip", "LKnee", "LAnkle",
+    "Spine", "Thorax", "Neck/Nose", "Head",
+    "LShoulder", "LElbow", "LWrist",
+    "RShoulder", "RElbow", "RWrist"
+]
+
+
+# version of the .npz pose container written by save_poses
+POSE_FORMAT_VERSION = 1
+
+
+def save_poses(path, poses, **meta):
+    """
+    Canonical 3D result: an uncompressed .npz with
+    - poses: (T, 17, 3) float32 in JOINT_NAMES order
+    - meta: small JSON header (format version, joint names and e.g. video_file / fps / width / height)
+    Uncompressed so that load_poses can memory-map the poses.
+    """
+    meta = dict(meta, format=POSE_FORMAT_VERSION, joints=JOINT_NAMES)
+    np.savez(path, poses=np.asanyarray(poses, dtype=np.float32), meta=np.array(json.dumps(meta, ensure_ascii=False)))
+    return path
+
+
+def _npz_member(path, name):
+    """(offset, shape, dtype, fortran_order) of the raw data of an uncompressed array in an .npz, or None"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(path, 'rb') as f:
+        # local file header: 30 bytes, then the file name and the extra field
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        return f.tell(), shape, dtype, fortran_order
+
+
+def load_poses(path, mmap=True):
+    """
+    (poses (T, 17, 3), meta dict) from a save_poses .npz. With mmap the poses are a read-only memory map of
+    the file, nothing is parsed or copied. JSON results (3d_result.json, PoseResult.save_json, uploaded files)
+    are parsed into a float64 array as a fallback.
+    """
+    if not path.endswith('.npz'):
+        return _load_json_poses(path)
+
+    with np.load(path) as archive:
+        meta = json.loads(str(archive['meta']))
+        member = _npz_member(path, 'poses') if mmap else None
+        if member is None:
+            return archive['poses'], meta
+
+    offset, shape, dtype, fortran_order = member
+    if not np.prod(shape):
+        return np.zeros(shape, dtype=dtype), meta
+    poses = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+    return poses, meta
+
+
+def _load_json_poses(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    poses = []
+    for frame in data["frames"]:
+        coordinates = frame["coordinates"]
+        if coordinates and isinstance(coordinates[0], dict):
+            joints = {c["joint_name"]: (c["x"], c["y"], c["z"]) for c in coordinates}
+            coordinates = [joints[name] for name in JOINT_NAMES]
+        poses.append(coordinates)
+
+    meta = {key: value for key, value in data.items() if key != "frames"}
+    return np.array(poses, dtype=np.float64).reshape(-1, len(JOINT_NAMES), 3), meta
+
+
+class PoseArchiveWriter(object):
+    """
+    save_poses for results that arrive in chunks (stream_pose3D): the poses are appended to `path`.part and
+    packed into the .npz on close, reading them back through a memory map, so memory stays bounded.
+    meta can still be updated before close.
+    """
+    def __init__(self, path, **meta):
+        self.path = path
+        self.meta = meta
+        self.num_frames = 0
+        self._part = path + '.part'
+        self._file = open(self._part, 'wb')
+
+    def write(self, poses):
+        """poses: (n, 17, 3) following the frames written so far"""
+        poses = np.ascontiguousarray(poses, dtype=np.float32)
+        self._file.write(poses.tobytes())
+        self.num_frames += len(poses)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        shape = (self.num_frames, len(JOINT_NAMES), 3)
+        if self.num_frames:
+            poses = np.memmap(self._part, dtype=np.float32, mode='r', shape=shape)
+        else:
+            poses = np.zeros(shape, dtype=np.float32)
+        save_poses(self.path, poses, **self.meta)
+        del poses
+        os.remove(self._part)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif not self._file.closed:
+            # do not leave a partial result behind
+            self._file.close()
+            os.remove(self._part)
+
+
+def export_json(poses, path, video_file, named_joints=False, chunk_size=1024):
+    """
+    Optional JSON export of a (T, 17, 3) array (e.g. the memory map of load_poses), converted in chunks.
+    named_joints: see PoseJsonWriter
+    """
+    with PoseJsonWriter(path, video_file, named_joints=named_joints) as writer:
+        for start in range(0, len(poses), chunk_size):
+            writer.write(np.asarray(poses[start:start + chunk_size]))
+    return path
+
+
+# first bytes of a write_result message
+RESULT_MAGIC = b'POSE'
+
+
+def write_result(stream, poses, chunk_size=4096, **meta):
+    """
+    Send a 3D result over a pipe / socket / binary file as one length-prefixed message (vis.py --result_fd):
+    RESULT_MAGIC, <u4 header length>, JSON header {"shape", "dtype", "meta"}, raw float32 poses in C order.
+    The poses (e.g. the memory map of load_poses) are written in chunks of chunk_size frames.
+    """
+    header = json.dumps({"shape": list(poses.shape), "dtype": np.dtype(np.float32).str, "meta": meta},
+                        ensure_ascii=False).encode('utf-8')
+    stream.write(RESULT_MAGIC + struct.pack('<I', len(header)) + header)
+    for start in range(0, len(poses), chunk_size):
+        stream.write(np.ascontiguousarray(poses[start:start + chunk_size], dtype=np.float32).data)
+    stream.flush()
+
+
+def _read_exact(stream, buffer):
+    """fill buffer (bytearray or 1-D uint8 array) from stream"""
+    view = memoryview(buffer)
+    received = 0
+    while received < len(view):
+        n = stream.readinto(view[received:])
+        if not n:
+            raise EOFError(f"Result stream ended after {received} of {len(view)} bytes")
+        received += n
+
+
+def read_result(stream):
+    """
+    (poses, meta) from a write_result message; the poses are read straight into the returned array.
+    Reading the result of a vis.py worker, which keeps stdout for its logs:
+
+        r, w = os.pipe()
+        proc = subprocess.Popen([sys.executable, 'MotionAGFormer/run/vis.py', '--video', video, '--render', 'none',
+                                 '--result_fd', str(w)], pass_fds=(w,))
+        os.close(w)
+        with os.fdopen(r, 'rb') as pipe:
+            poses, meta = read_result(pipe)
+        proc.wait()
+    """
+    prefix = bytearray(len(RESULT_MAGIC) + 4)
+    _read_exact(stream, prefix)
+    if bytes(prefix[:len(RESULT_MAGIC)]) != RESULT_MAGIC:
+        raise ValueError("Not a pose result message")
+    header = bytearray(struct.unpack('<I', prefix[len(RESULT_MAGIC):])[0])
+    _read_exact(stream, header)
+    header = json.loads(header.decode('utf-8'))
+
+    poses = np.empty(header["shape"], dtype=np.dtype(header["dtype"]))
+    _read_exact(stream, poses.reshape(-1).view(np.uint8))
+    return poses, header["meta"]
+
+
+class PoseJsonWriter(object):
+    """
+    Writes a 3D result JSON incrementally: frames are appended as they are lifted and total_frames comes last,
+    so a long video never has to be held in memory as nested lists. The file parses to the same dict as
+    the one written at once ({"video_file", "total_frames", "frames": [{"frame_index", "coordinates"}]}).
+
+    :param path: output JSON path
+    :param video_file: value of "video_file"
+    :param named_joints: False: coordinates as [[x, y, z], ...] (vis.py 3d_result.json),
+                         True: [{"joint_name", "x", "y", "z"}, ...] (PoseResult.save_json, JsonAnalist)
+    """
+    def __init__(self, path, video_file, named_joints=False):
+        self.path = path
+        self.named_joints = named_joints
+        self.num_frames = 0
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write('{\n  "video_file": %s,\n  "frames": [' % json.dumps(video_file, ensure_ascii=False))
+
+    def _coordinates(self, pose):
+        if self.named_joints:
+            return [{"joint_name": name, "x": float(x), "y": float(y), "z": float(z)}
+                    for name, (x, y, z) in zip(JOINT_NAMES, pose)]
+        return pose.tolist()
+
+    def write(self, poses):
+        """poses: (n, 17, 3) following the frames written so far"""
+        for pose in poses:
+            frame = {"frame_index": self.num_frames, "coordinates": self._coordinates(pose)}
+            self._file.write(('\n    ' if self.num_frames == 0 else ',\n    ') + json.dumps(frame))
+            self.num_frames += 1
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write('\n  ],\n  "total_frames": %d\n}\n' % self.num_frames)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
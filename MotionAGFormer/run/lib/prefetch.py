@@ -0,0 +1,159 @@
+import time
+import queue
+import threading
+
+import cv2
+
+
+class VideoInfo(object):
+    """
+    Container metadata (fps, frame size, frame count) probed once and carried through the pipeline,
+    so later stages do not have to open the video again just to read a property or a frame shape.
+    """
+    def __init__(self, fps, width, height, num_frames):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+
+    @classmethod
+    def from_capture(cls, cap):
+        return cls(cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                   int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+    @classmethod
+    def probe(cls, video):
+        cap = cv2.VideoCapture(video)
+        info = cls.from_capture(cap)
+        cap.release()
+        return info
+
+    @property
+    def img_size(self):
+        """(height, width), the order lift_pose3D expects"""
+        return self.height, self.width
+
+
+class FramePrefetcher(object):
+    """
+    Decodes a video in a background thread into a bounded queue so that decoding overlaps with inference.
+
+    Iterating yields (frame_index, frame) for every frame that could be read, in order. frame_index counts
+    read attempts like the original `for ii in range(video_length): cap.read()` loops.
+
+    :param video: path of the video
+    :param max_queue: maximum number of decoded frames waiting for the consumer
+    :param resize: optional (width, height); frames are resized right after decoding
+    """
+    _END = object()
+
+    def __init__(self, video, max_queue=32, resize=None):
+        self.video = video
+        self.resize = resize
+
+        cap = cv2.VideoCapture(video)
+        self.info = VideoInfo.from_capture(cap)
+        self.num_frames = self.info.num_frames
+        self.fps = self.info.fps
+        self.width = self.info.width
+        self.height = self.info.height
+        self._cap = cap
+
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+        # metrics
+        self.frames_decoded = 0
+        self.decode_time = 0.
+        self.producer_stall_time = 0.  # decoder waiting for a free slot (consumer is the bottleneck)
+        self.consumer_stall_time = 0.  # consumer waiting for a frame (decoder is the bottleneck)
+        self._depth_sum = 0
+        self._depth_max = 0
+        self._depth_samples = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._decode, daemon=True)
+            self._thread.start()
+        return self
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.producer_stall_time += time.perf_counter() - start
+
+    def _decode(self):
+        try:
+            for ii in range(self.num_frames):
+                if self._stop.is_set():
+                    break
+                start = time.perf_counter()
+                ret, frame = self._cap.read()
+                if ret and self.resize is not None:
+                    frame = cv2.resize(frame, self.resize, interpolation=cv2.INTER_AREA)
+                self.decode_time += time.perf_counter() - start
+
+                if not ret:
+                    continue
+                self.frames_decoded += 1
+                self._put((ii, frame))
+        except Exception as e:
+            self._error = e
+        finally:
+            self._cap.release()
+            self._put(self._END)
+
+    def __iter__(self):
+        self.start()
+        while True:
+            depth = self._queue.qsize()
+            self._depth_sum += depth
+            self._depth_max = max(self._depth_max, depth)
+            self._depth_samples += 1
+
+            start = time.perf_counter()
+            item = self._queue.get()
+            self.consumer_stall_time += time.perf_counter() - start
+
+            if item is self._END:
+                break
+            yield item
+
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            # unblock the decoder if it is waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._thread.join(timeout=0.1)
+        else:
+            self._cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def metrics(self):
+        return {
+            "frames_decoded": self.frames_decoded,
+            "decode_time": self.decode_time,
+            "producer_stall_time": self.producer_stall_time,
+            "consumer_stall_time": self.consumer_stall_time,
+            "mean_queue_depth": self._depth_sum / max(self._depth_samples, 1),
+            "max_queue_depth": self._depth_max,
+        }
@@ -0,0 +1,96 @@
+import copy
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+# fp32: the downloaded checkpoints, int8: converted offline by quantize_models.py and saved next to them
+MODEL_VARIANTS = ('fp32', 'int8')
+
+# one HRNet input patch (cfg.MODEL.IMAGE_SIZE is 288x384), used to trace the graph for quantization
+HRNET_INPUT = (1, 3, 384, 288)
+
+
+def check_variant(variant):
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant: {variant} (expected one of {MODEL_VARIANTS})")
+
+
+def variant_path(checkpoint_path, variant):
+    """pose_hrnet_w48_384x288.pth --> pose_hrnet_w48_384x288.int8.pth, motionagformer-b-h36m.pth.tr likewise"""
+    check_variant(variant)
+    if variant == 'fp32':
+        return checkpoint_path
+    root = checkpoint_path
+    for ext in ('.tr', '.pth'):
+        if root.endswith(ext):
+            root = root[:-len(ext)]
+    return f'{root}.{variant}.pth'
+
+
+def quantized_engine():
+    """x86 / fbgemm on Intel and AMD CPUs, qnnpack on ARM"""
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    raise RuntimeError("This PyTorch build has no quantized CPU engine, use the fp32 models")
+
+
+def quantize_pose3D(model, engine):
+    """
+    MotionAGFormer with dynamic int8 nn.Linear: weights are stored in int8, activations are quantized on the fly,
+    so no calibration data is needed. GCN aggregation, attention scores and normalization stay in fp32.
+    """
+    torch.backends.quantized.engine = engine
+    model = quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+    model.variant = 'int8'
+    return model
+
+
+def prepare_hrnet(model, engine):
+    """
+    HRNet with observers for static int8 quantization (convolutions with folded BatchNorm).
+    Run calibration patches through the returned model, then pass it to convert_hrnet.
+    """
+    torch.backends.quantized.engine = engine
+    return prepare_fx(copy.deepcopy(model).cpu().eval(), get_default_qconfig_mapping(engine),
+                      example_inputs=(torch.zeros(HRNET_INPUT),))
+
+
+def convert_hrnet(prepared):
+    model = convert_fx(prepared)
+    model.variant = 'int8'
+    return model
+
+
+def save_quantized(model, path, engine):
+    torch.save({'variant': model.variant, 'engine': engine, 'model': model.state_dict()}, path)
+
+
+def _load_quantized(path, build):
+    """build(engine) returns a quantized model of the same structure; its weights are replaced by the saved ones"""
+    checkpoint = torch.load(path, map_location='cpu')
+    engine = checkpoint['engine']
+    if engine not in torch.backends.quantized.supported_engines:
+        raise RuntimeError(f"{path} was converted for the '{engine}' quantized engine, which is not available here; "
+                           f"run quantize_models.py on this machine or use the fp32 models")
+    model = build(engine)
+    model.load_state_dict(checkpoint['model'])
+    return model.eval()
+
+
+def load_pose3D_int8(model, path):
+    """model: fp32 MotionAGFormer, only used for its structure"""
+    return _load_quantized(path, lambda engine: quantize_pose3D(model, engine))
+
+
+def load_hrnet_int8(model, path):
+    """model: fp32 PoseHighResolutionNet, only used for its structure"""
+    def build(engine):
+        prepared = prepare_hrnet(model, engine)
+        prepared(torch.zeros(HRNET_INPUT))  # observers need one batch before convert
+        return convert_hrnet(prepared)
+
+    return _load_quantized(path, build)
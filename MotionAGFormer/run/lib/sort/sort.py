@@ -221,6 +221,37 @@ class Sort(object):
             return np.concatenate(ret)
         return np.empty((0, 5))
 
+    def tracked(self):
+        """
+        Trackers that were matched to a detection at the last update() (the same time_since_update < 1 filter
+        update() uses). Trackers left unmatched are only kept alive for re-association.
+        """
+        return [trk for trk in self.trackers if trk.time_since_update < 1]
+
+    def predict(self):
+        """
+        Advances all trackers by one frame without a detection (constant velocity Kalman prediction).
+        Returns the predicted boxes of the trackers matched at the last update() (see tracked), in the same
+        format as update(): [[x1,y1,x2,y2,ID],...]. Empty if none are left: run a detection instead.
+
+        NOTE: All trackers are advanced and kept alive so that the next update() can re-associate them.
+        A propagated frame counts as a hit for the tracked ones, so they stay tracked over several predictions
+        and their hit_streak does not drop below min_hits, which would hide them from the next update().
+        """
+        self.frame_count += 1
+        tracked = self.tracked()
+        ret = []
+        for trk in reversed(self.trackers):
+            d = trk.predict()[0]
+            if np.any(np.isnan(d)) or trk not in tracked:
+                continue
+            trk.time_since_update = 0
+            trk.hit_streak += 1
+            ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))
+        if (len(ret) > 0):
+            return np.concatenate(ret)
+        return np.empty((0, 5))
+
 
 def parse_args():
     """Parse input arguments."""
@@ -52,7 +52,7 @@ def write(x, img, colors):
     return img
 
 
-def arg_parse():
+def arg_parse(argv=None):
     """"
     Parse arguements to the detect module
 
@@ -73,7 +73,7 @@ def arg_parse():
     parser.add_argument('-np', '--num-person', type=int, default=1, help='number of estimated human poses. [1, 2]')
     parser.add_argument('--gpu', type=str, default='0', help='input video')
     
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def load_model(args=None, CUDA=None, inp_dim=416):
@@ -102,15 +102,13 @@ def load_model(args=None, CUDA=None, inp_dim=416):
     return model
 
 
-def yolo_human_det(img, model=None, reso=416, confidence=0.70):
-    args = arg_parse()
-    # args.reso = reso
+def yolo_human_det(img, model=None, reso=416, confidence=0.70, nms_thresh=0.4):
     inp_dim = reso
     num_classes = 80
 
     CUDA = torch.cuda.is_available()
     if model is None:
-        model = load_model(args, CUDA, inp_dim)
+        model = load_model(arg_parse(), CUDA, inp_dim)
 
     if type(img) == str:
         assert os.path.isfile(img), 'The image path does not exist'
@@ -124,11 +122,20 @@ def yolo_human_det(img, model=None, reso=416, confidence=0.70):
             img_dim = img_dim.cuda()
             img = img.cuda()
         output = model(img, CUDA)
-        output = write_results(output, confidence, num_classes, nms=True, nms_conf=args.nms_thresh, det_hm=True)
+        output = write_results(output, confidence, num_classes, nms=True, nms_conf=nms_thresh, det_hm=True)
 
         if len(output) == 0:
             return None, None
 
+    return rescale_boxes(output, img_dim, inp_dim)
+
+
+def rescale_boxes(output, img_dim, inp_dim):
+    """
+    Map write_results detections of one image from the letterboxed input back to the original image.
+    Returns bboxs (N, 4) and scores (N, 1) as numpy arrays.
+    """
+    with torch.no_grad():
         img_dim = img_dim.repeat(output.size(0), 1)
         scaling_factor = torch.min(inp_dim / img_dim, 1)[0].view(-1, 1)
 
@@ -154,3 +161,73 @@ def yolo_human_det(img, model=None, reso=416, confidence=0.70):
     bboxs = np.array(bboxs)
 
     return bboxs, scores
+
+
+def get_input_buffer(model, batch_size, inp_dim):
+    """
+    (K, 3, inp_dim, inp_dim) input tensor kept on the model and reused across calls.
+    It is only re-allocated when a larger batch is requested.
+    """
+    buffer = getattr(model, 'input_buffer', None)
+    if buffer is None or buffer.size(0) < batch_size or buffer.size(2) != inp_dim:
+        buffer = torch.empty((batch_size, 3, inp_dim, inp_dim))
+        if next(model.parameters()).is_cuda:
+            buffer = buffer.cuda()
+        model.input_buffer = buffer
+    return buffer[:batch_size]
+
+
+def letterbox_into(buffer, img, inp_dim):
+    """
+    Same result as preprocess.prep_image, but written into an existing (3, inp_dim, inp_dim) tensor.
+    """
+    img_w, img_h = img.shape[1], img.shape[0]
+    new_w = int(img_w * min(inp_dim / img_w, inp_dim / img_h))
+    new_h = int(img_h * min(inp_dim / img_w, inp_dim / img_h))
+    resized_image = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
+
+    top = (inp_dim - new_h) // 2
+    left = (inp_dim - new_w) // 2
+    buffer.fill_(128 / 255.0)
+    resized = torch.from_numpy(resized_image[:, :, ::-1].transpose((2, 0, 1)).copy())
+    buffer[:, top:top + new_h, left:left + new_w] = resized.float().div_(255.0)
+
+
+def detect_batch(frames, model, reso=416, confidence=0.70, nms_thresh=0.4):
+    """
+    Detect people on K frames with a single Darknet forward pass.
+    NMS (write_results) is applied per image.
+
+    Returns a list with one (bboxs, scores) tuple per frame; (None, None) when nobody is detected.
+    """
+    inp_dim = reso
+    num_classes = 80
+    CUDA = torch.cuda.is_available()
+
+    if len(frames) == 0:
+        return []
+
+    inputs = get_input_buffer(model, len(frames), inp_dim)
+    with torch.no_grad():
+        for k, frame in enumerate(frames):
+            letterbox_into(inputs[k], frame, inp_dim)
+
+        prediction = model(inputs, CUDA)
+
+    results = []
+    for k, frame in enumerate(frames):
+        img_dim = torch.FloatTensor((frame.shape[1], frame.shape[0])).repeat(1, 2)
+        if CUDA:
+            img_dim = img_dim.cuda()
+
+        with torch.no_grad():
+            # write_results returns early for the whole batch when an image has no person, so run it per image
+            output = write_results(prediction[k:k + 1], confidence, num_classes, nms=True, nms_conf=nms_thresh,
+                                   det_hm=True)
+
+        if len(output) == 0:
+            results.append((None, None))
+        else:
+            results.append(rescale_boxes(output, img_dim, inp_dim))
+
+    return results
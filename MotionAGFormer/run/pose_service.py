@@ -0,0 +1,196 @@
+import os
+import sys
+import asyncio
+import threading
+
+# vis.py と同じく `lib.*` を解決できるようにする
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from lib.hrnet.gen_kpts import load_models as load_models_2D
+from lib.prefetch import VideoInfo
+from lib.pose_io import JOINT_NAMES, save_poses, export_json
+from vis import estimate_pose2D, load_pose3D_model, lift_pose3D, render_video, stream_pose3D
+
+"""
+pose_service.py
+
+vis.py をサブプロセスで毎回起動する代わりに、YOLOv3 / HRNet / MotionAGFormer を
+一度だけ読み込んで使い回すインプロセスの姿勢推定サービス。
+
+    service = PoseEstimationService.shared()
+    result = await service.estimate("swing.mp4")
+    result.poses_3d  # (T, 17, 3) float32
+"""
+
+
+class PoseResult:
+    """
+    1本の動画に対する姿勢推定結果
+    - keypoints_2d: (T, 17, 3) 画像座標 + 信頼度 (H36M順)
+    - poses_3d: (T, 17, 3) ワールド座標 (床 z=0, 最大値1に正規化)
+    """
+    def __init__(self, video_path, keypoints_2d, poses_3d, fps, width, height):
+        self.video_path = video_path
+        self.keypoints_2d = keypoints_2d
+        self.poses_3d = poses_3d
+        self.fps = fps
+        self.width = width
+        self.height = height
+
+    @property
+    def num_frames(self):
+        return len(self.poses_3d)
+
+    def save(self, path):
+        """3D座標を .npz に保存 (lib.pose_io.load_poses でメモリマップして読める)。これが正規の保存形式"""
+        return save_poses(path, self.poses_3d, video_file=self.video_path, fps=self.fps, width=self.width,
+                          height=self.height)
+
+    def to_json_dict(self):
+        """JsonAnalist.analyze_json が読める joint_name 付きの形式に変換"""
+        return {
+            "video_file": self.video_path,
+            "total_frames": self.num_frames,
+            "frames": [
+                {
+                    "frame_index": i,
+                    "coordinates": [
+                        {"joint_name": name, "x": float(x), "y": float(y), "z": float(z)}
+                        for name, (x, y, z) in zip(JOINT_NAMES, pose)
+                    ]
+                }
+                for i, pose in enumerate(self.poses_3d)
+            ]
+        }
+
+    def save_json(self, path):
+        """to_json_dict の形式の JSON として書き出す (任意のエクスポート用)"""
+        return export_json(self.poses_3d, path, self.video_path, named_joints=True)
+
+
+class PoseEstimationService:
+    """
+    常駐型の姿勢推定サービス。モデルは最初の推定時 (または load()) に一度だけ読み込む。
+    推論はロックで直列化し、イベントループをブロックしないようスレッドで実行する。
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, det_dim=416, checkpoint_dir='MotionAGFormer/checkpoint', hrnet_batch_size=8,
+                 det_batch_size=4, det_stride=1, track_kpts=False, prefetch_depth=32, decode_width=None,
+                 lift_batch_size=8, lift_max_memory_mb=2048, lift_window_stride=None, lift_window_mode='blend',
+                 lift_native_length=False, lift_flip='batched', hrnet_variant='fp32', lift_variant='fp32',
+                 lift_fused_attention=True, stream_min_frames=None, stream_chunk_frames=1944):
+        self.det_dim = det_dim
+        self.hrnet_batch_size = hrnet_batch_size
+        self.det_batch_size = det_batch_size
+        self.det_stride = det_stride
+        self.track_kpts = track_kpts
+        self.prefetch_depth = prefetch_depth
+        self.decode_width = decode_width
+        self.lift_options = dict(batch_size=lift_batch_size, max_memory_mb=lift_max_memory_mb,
+                                 window_stride=lift_window_stride, window_mode=lift_window_mode,
+                                 native_length=lift_native_length, flip=lift_flip)
+        self.checkpoint_dir = checkpoint_dir
+        self.hrnet_variant = hrnet_variant
+        self.lift_variant = lift_variant
+        self.lift_fused_attention = lift_fused_attention
+        self.stream_min_frames = stream_min_frames
+        self.stream_chunk_frames = stream_chunk_frames
+        self._models_2D = None
+        self._model_3D = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, **kwargs):
+        """
+        プロセス内で共有するインスタンスを返す
+        kwargs (config.yaml の pose_estimation) は最初の生成時のみ使われる
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(**kwargs)
+            return cls._shared
+
+    @property
+    def is_loaded(self):
+        return self._models_2D is not None and self._model_3D is not None
+
+    def load(self):
+        """YOLOv3 / HRNet / MotionAGFormer を読み込む (読み込み済みなら何もしない)"""
+        with self._lock:
+            self._load_locked()
+
+    def _load_locked(self):
+        if self._models_2D is None:
+            self._models_2D = load_models_2D(det_dim=self.det_dim, argv=[], variant=self.hrnet_variant)
+        if self._model_3D is None:
+            self._model_3D = load_pose3D_model(self.checkpoint_dir, variant=self.lift_variant,
+                                               fused_attention=self.lift_fused_attention)
+
+    async def estimate(self, video_path, flip=None) -> PoseResult:
+        return await asyncio.to_thread(self.estimate_sync, video_path, flip)
+
+    def estimate_sync(self, video_path, flip=None) -> PoseResult:
+        """flip: このリクエストだけ flip TTA のモード (off / on / batched) を変える場合に指定"""
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+
+        # fps / 画像サイズは 2D 推定のデコード時に一度だけ取得したものを使う
+        stats = {}
+        with self._lock:
+            self._load_locked()
+            keypoints = estimate_pose2D(video_path, models=self._models_2D, batch_size=self.hrnet_batch_size,
+                                        det_batch_size=self.det_batch_size, det_stride=self.det_stride,
+                                        track_kpts=self.track_kpts, prefetch_depth=self.prefetch_depth,
+                                        decode_width=self.decode_width, stats=stats)
+            info = stats['info']
+            lift_options = dict(self.lift_options)
+            if flip is not None:
+                lift_options['flip'] = flip
+            poses_3d = lift_pose3D(keypoints, self._model_3D, info.img_size, **lift_options)
+
+        return PoseResult(video_path, keypoints[0], poses_3d, info.fps, info.width, info.height)
+
+    def should_stream(self, video_path):
+        """stream_min_frames 以上の長い動画は estimate_to_file でチャンクごとに処理する"""
+        return self.stream_min_frames is not None and VideoInfo.probe(video_path).num_frames >= self.stream_min_frames
+
+    async def estimate_to_file(self, video_path, output_path, flip=None, on_chunk=None) -> int:
+        return await asyncio.to_thread(self.estimate_to_file_sync, video_path, output_path, flip, on_chunk)
+
+    def estimate_to_file_sync(self, video_path, output_path, flip=None, on_chunk=None) -> int:
+        """
+        長い動画 (打撃練習の全体など) 向けのストリーミング推定。2D推定と持ち上げを stream_chunk_frames ごとに行い、
+        PoseResult.save と同じ .npz として output_path に追記していくので、メモリ使用量は動画の長さによらない。
+        結果はメモリに残らないため render はできない。戻り値は書き出したフレーム数
+        on_chunk: 持ち上げたチャンク (n, 17, 3) ごとに呼ばれる (例: JsonAnalist.StreamingAnalyzer.push で途中経過を解析)
+        """
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+
+        lift_options = dict(self.lift_options)
+        if lift_options.get('window_mode') != 'center':
+            # 重なり窓のクロスフェードは動画全体が必要。center は窓が埋まるごとに書き出せる
+            lift_options['window_stride'] = None
+        if flip is not None:
+            lift_options['flip'] = flip
+        with self._lock:
+            self._load_locked()
+            return stream_pose3D(video_path, output_path, models=self._models_2D, model=self._model_3D,
+                                 chunk_frames=self.stream_chunk_frames, batch_size=self.hrnet_batch_size,
+                                 det_batch_size=self.det_batch_size, det_stride=self.det_stride,
+                                 track_kpts=self.track_kpts, prefetch_depth=self.prefetch_depth,
+                                 decode_width=self.decode_width, lift_options=lift_options, on_chunk=on_chunk)
+
+    async def render(self, result: PoseResult, output_dir, mode='full') -> str:
+        return await asyncio.to_thread(self.render_sync, result, output_dir, mode)
+
+    def render_sync(self, result: PoseResult, output_dir, mode='full') -> str:
+        """
+        可視化動画を output_dir に書き出してパスを返す (推定とは独立に、必要になった時だけ呼ぶ)
+        mode: preview (2Dオーバーレイのみ) / full (2D入力 + 3D再構成)。none / json-only は何もせず None
+        """
+        output_dir = os.path.join(output_dir, '')
+        os.makedirs(output_dir, exist_ok=True)
+        return render_video(result.video_path, output_dir, result.keypoints_2d, result.poses_3d, mode=mode,
+                            fps=result.fps)
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from lib.hrnet.gen_kpts import load_models as load_models_2D, model_load, cfg
+from lib.quantize import (quantized_engine, quantize_pose3D, prepare_hrnet, convert_hrnet, save_quantized,
+                          variant_path)
+from vis import estimate_pose2D, load_pose3D_model, lift_pose3D
+from benchmark_lift import mpjpe
+
+"""
+quantize_models.py
+
+HRNet (静的int8, 畳み込み) と MotionAGFormer (動的int8, nn.Linear) の量子化版を元の重みの隣に書き出し、
+サンプル動画で fp32 との差を確認する。どれかの差が閾値を超えた場合は終了コード1。
+
+    python MotionAGFormer/run/quantize_models.py --video swing1.mp4 swing2.mp4
+
+- HRNet のキャリブレーションには --calib_video (省略時は --video) の動画から切り出した人物パッチを使う
+- 書き出した重みは config.yaml の pose_estimation.hrnet_variant / lift_variant を int8 にすると使われる
+- 量子化の重みは変換したマシンの quantized engine (x86 / qnnpack) 向けなので、実行するマシンで変換する
+- --check_only: 変換せず、既存の int8 の重みを確認だけする
+"""
+
+
+def keypoint_error(a, b):
+    """mean pixel distance between two (1, T, 17, 3) keypoint arrays (x, y only)"""
+    return float(np.mean(np.linalg.norm(a[..., :2] - b[..., :2], axis=-1)))
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', type=str, nargs='+', required=True, help='Sample clips for the accuracy check')
+    parser.add_argument('--calib_video', type=str, nargs='+', default=None,
+                        help='Clips for HRNet calibration (default: --video)')
+    parser.add_argument('--checkpoint', type=str, default='MotionAGFormer/checkpoint')
+    parser.add_argument('--hrnet_batch', type=int, default=8, help='HRNet patches per forward pass')
+    parser.add_argument('--det_batch', type=int, default=4, help='YOLOv3 frames per forward pass')
+    parser.add_argument('--max_kpt_error', type=float, default=3.0, help='Allowed mean 2D keypoint error [px]')
+    parser.add_argument('--max_mpjpe', type=float, default=0.02,
+                        help='Allowed MPJPE of the 3D output (world coordinates scaled to max 1)')
+    parser.add_argument('--check_only', action='store_true', help='Only check existing int8 weights')
+    args = parser.parse_args()
+
+    pose_options = dict(batch_size=args.hrnet_batch, det_batch_size=args.det_batch)
+    human_model, hrnet = load_models_2D(det_dim=416, argv=[])
+    model_3d = load_pose3D_model(args.checkpoint)
+
+    if not args.check_only:
+        engine = quantized_engine()
+
+        # HRNet: observe activation ranges on real person patches, then convert
+        prepared = prepare_hrnet(hrnet, engine)
+        for video in args.calib_video or args.video:
+            print(f'Calibrating HRNet on {video}')
+            estimate_pose2D(video, models=(human_model, prepared), **pose_options)
+        hrnet_path = variant_path(cfg.OUTPUT_DIR, 'int8')
+        save_quantized(convert_hrnet(prepared), hrnet_path, engine)
+        print(f'HRNet int8 ({engine}) --> {hrnet_path}')
+
+        lift_path = variant_path(os.path.join(args.checkpoint, 'motionagformer-b-h36m.pth.tr'), 'int8')
+        save_quantized(quantize_pose3D(model_3d, engine), lift_path, engine)
+        print(f'MotionAGFormer int8 ({engine}) --> {lift_path}')
+
+    # accuracy regression check, loading the int8 weights the same way the pipeline does
+    hrnet_int8 = model_load(cfg, 'int8')
+    model_3d_int8 = load_pose3D_model(args.checkpoint, 'int8')
+
+    failed = False
+    print(f"{'video':<24} {'2D [s] fp32/int8':>17} {'kpt err [px]':>13} {'lift [s] fp32/int8':>19} "
+          f"{'MPJPE lift':>11} {'MPJPE total':>12}")
+    for video in args.video:
+        stats = {}
+        kpts, t_2d = timed(estimate_pose2D, video, models=(human_model, hrnet), stats=stats, **pose_options)
+        kpts_int8, t_2d_int8 = timed(estimate_pose2D, video, models=(human_model, hrnet_int8), **pose_options)
+        img_size = stats['info'].img_size
+
+        poses, t_lift = timed(lift_pose3D, kpts, model_3d, img_size)
+        poses_int8, t_lift_int8 = timed(lift_pose3D, kpts, model_3d_int8, img_size)
+        poses_total = lift_pose3D(kpts_int8, model_3d_int8, img_size)
+
+        kpt_err = keypoint_error(kpts, kpts_int8)
+        lift_err, total_err = mpjpe(poses_int8, poses), mpjpe(poses_total, poses)
+        ok = kpt_err <= args.max_kpt_error and lift_err <= args.max_mpjpe and total_err <= args.max_mpjpe
+        failed |= not ok
+
+        name = os.path.basename(video)[:24]
+        print(f"{name:<24} {t_2d:>8.2f}/{t_2d_int8:<8.2f} {kpt_err:>13.3f} {t_lift:>9.2f}/{t_lift_int8:<9.2f} "
+              f"{lift_err:>11.5f} {total_err:>12.5f}  {'OK' if ok else 'FAIL'}")
+
+    if failed:
+        print(f'int8 models exceed the tolerance (kpt err {args.max_kpt_error}px, MPJPE {args.max_mpjpe}), '
+              f'keep hrnet_variant / lift_variant at fp32')
+        sys.exit(1)
+    print('int8 models are within the tolerance')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import sys
 import argparse
 import cv2
-from lib.preprocess import h36m_coco_format, revise_kpts
-from lib.hrnet.gen_kpts import gen_video_kpts as hrnet_pose
+from lib.preprocess import h36m_coco_format, revise_kpts, coco_h36m
+from lib.hrnet.gen_kpts import gen_video_kpts as hrnet_pose, iter_video_kpts
+from lib.hrnet.gen_kpts import load_models as load_models_2D
+from lib.prefetch import FramePrefetcher, VideoInfo
+from lib.compositor import panel_2d, DemoCompositor, PanelSpool
+from lib.pose_io import PoseArchiveWriter, save_poses, load_poses, export_json, write_result
+from lib.quantize import MODEL_VARIANTS, check_variant, variant_path, load_pose3D_int8
 import os 
 import numpy as np
 import torch
@@ -10,126 +15,83 @@ import torch.nn as nn
 import glob
 from tqdm import tqdm
 import copy
-import json 
+import itertools
+from collections import deque
 
 sys.path.append(os.getcwd())
 from lib.utils import normalize_screen_coordinates, camera_to_world
 from MotionAGFormer.model.MotionAGFormer import MotionAGFormer
+from MotionAGFormer.model.modules.graph import GCN
+from MotionAGFormer.model.modules.attention import set_fused_attention
 
-import matplotlib
-import matplotlib.pyplot as plt 
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.gridspec as gridspec
+# none: 3D result only (no files), json-only: + result file (3d_result.npz, JSON with --out_json),
+# preview: + 2D overlay video, full: + 2D/3D demo video
+# (--stream appends to the result file as it goes, so it always writes 3d_result.npz)
+RENDER_MODES = ('none', 'json-only', 'preview', 'full')
 
-plt.switch_backend('agg')
-matplotlib.rcParams['pdf.fonttype'] = 42
-matplotlib.rcParams['ps.fonttype'] = 42
 
-def show2Dpose(kps, img):
-    connections = [[0, 1], [1, 2], [2, 3], [0, 4], [4, 5],
-                   [5, 6], [0, 7], [7, 8], [8, 9], [9, 10],
-                   [8, 11], [11, 12], [12, 13], [8, 14], [14, 15], [15, 16]]
-
-    LR = np.array([0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0], dtype=bool)
-
-    lcolor = (255, 0, 0)
-    rcolor = (0, 0, 255)
-    thickness = 3
-
-    for j,c in enumerate(connections):
-        start = map(int, kps[c[0]])
-        end = map(int, kps[c[1]])
-        start = list(start)
-        end = list(end)
-        cv2.line(img, (start[0], start[1]), (end[0], end[1]), lcolor if LR[j] else rcolor, thickness)
-        cv2.circle(img, (start[0], start[1]), thickness=-1, color=(0, 255, 0), radius=3)
-        cv2.circle(img, (end[0], end[1]), thickness=-1, color=(0, 255, 0), radius=3)
-
-    return img
-
-
-def show3Dpose(vals, ax):
-    ax.view_init(elev=15., azim=70)
-
-    lcolor=(0,0,1)
-    rcolor=(1,0,0)
-
-    I = np.array([0, 0, 1, 4, 2, 5, 0, 7, 8,  8, 14, 15, 11, 12, 8,  9])
-    J = np.array([1, 4, 2, 5, 3, 6, 7, 8, 14, 11, 15, 16, 12, 13, 9, 10])
-
-    LR = np.array([0, 1, 0, 1, 0, 1, 0, 0, 0, 1,  0,  0,  1,  1, 0, 0], dtype=bool)
+def estimate_pose2D(video_path, models=None, batch_size=1, det_batch_size=1, det_stride=1, track_kpts=False,
+                    prefetch_depth=32, decode_width=None, stats=None, on_frame=None):
+    """
+    2D keypoints (H36M order) with the confidence score in the last dim: (1, T, 17, 3)
+    batch_size: HRNet patches per forward pass, det_batch_size: YOLOv3 frames per forward pass
+    det_stride: YOLOv3 runs every `det_stride` frames, boxes in between come from the SORT Kalman filter
+    track_kpts: crops follow the previous frame's keypoints, YOLOv3 only seeds / recovers the track
+    prefetch_depth: frames decoded ahead in a background thread, decode_width: downscale frames on decode
+    stats: optional dict that receives the decoder metrics and the VideoInfo probed while decoding
+    on_frame: per-frame callback (ii, frame, coco_kpts, scores) sharing the 2D decode pass
+    """
+    keypoints, scores = hrnet_pose(video_path, det_dim=416, num_peroson=1, gen_output=True, models=models,
+                                   batch_size=batch_size, det_batch_size=det_batch_size, det_stride=det_stride,
+                                   track_kpts=track_kpts, prefetch_depth=prefetch_depth,
+                                   decode_width=decode_width, stats=stats, on_frame=on_frame)
+    return h36m_keypoints(keypoints, scores)
 
-    for i in np.arange(len(I)):
-        x, y, z = [np.array([vals[I[i], j], vals[J[i], j]]) for j in range(3)]
-        ax.plot(x, y, z, lw=2, color=lcolor if LR[i] else rcolor)
 
-    RADIUS = 0.72
-    RADIUS_Z = 0.7
+def h36m_keypoints(keypoints, scores):
+    """HRNet output (M, T, 17, 2) COCO keypoints + (M, T, 17) scores --> (M, T, 17, 3) H36M keypoints + score"""
+    keypoints, scores, valid_frames = h36m_coco_format(keypoints, scores)
 
-    xroot, yroot, zroot = vals[0,0], vals[0,1], vals[0,2]
-    ax.set_xlim3d([-RADIUS+xroot, RADIUS+xroot])
-    ax.set_ylim3d([-RADIUS+yroot, RADIUS+yroot])
-    ax.set_zlim3d([-RADIUS_Z+zroot, RADIUS_Z+zroot])
-    ax.set_aspect('auto')
+    # Add conf score to the last dim
+    keypoints = np.concatenate((keypoints, scores[..., None]), axis=-1)
+    return keypoints
 
-    white = (1.0, 1.0, 1.0, 0.0)
-    ax.xaxis.set_pane_color(white)
-    ax.yaxis.set_pane_color(white)
-    ax.zaxis.set_pane_color(white)
 
-    ax.tick_params('x', labelbottom=False)
-    ax.tick_params('y', labelleft=False)
-    ax.tick_params('z', labelleft=False)
+def get_pose2D(video_path, output_dir, models=None, batch_size=1, det_batch_size=1, det_stride=1,
+               track_kpts=False, prefetch_depth=32, decode_width=None, panels=None, panel_size=540, stats=None,
+               write_files=True):
+    """
+    write_files: False (render none) returns the keypoints without writing input_2D/keypoints.npz
+    panels: when a PanelSpool (or a dict) is given, the 2D overlay panels for the demo video are drawn from the
+            frames decoded for HRNet and kept JPEG-encoded (frame index -> bytes), so that render_video(panels=...)
+            does not have to decode the video again. PanelSpool bounds the memory they take on long videos
+    stats: optional dict that receives the decoder metrics and the VideoInfo (stats['info'])
+    """
+    print('\nGenerating 2D pose...')
+    if stats is None:
+        stats = {}
 
+    on_frame = None
+    if panels is not None:
+        def on_frame(ii, frame, kpts, scores):
+            kpts_h36m, _ = coco_h36m(kpts[:1])
+            panels[ii] = cv2.imencode('.jpg', panel_2d(kpts_h36m[0], frame, panel_size))[1]
 
-def get_pose2D(video_path, output_dir):
-    cap = cv2.VideoCapture(video_path)
-    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    keypoints = estimate_pose2D(video_path, models=models, batch_size=batch_size, det_batch_size=det_batch_size,
+                                det_stride=det_stride, track_kpts=track_kpts, prefetch_depth=prefetch_depth,
+                                decode_width=decode_width, stats=stats, on_frame=on_frame)
+    print('Decoder: mean queue depth {:.1f}/{}, inference waited {:.2f}s for frames, decoder waited {:.2f}s'.format(
+        stats['mean_queue_depth'], prefetch_depth, stats['consumer_stall_time'], stats['producer_stall_time']))
 
-    print('\nGenerating 2D pose...')
-    keypoints, scores = hrnet_pose(video_path, det_dim=416, num_peroson=1, gen_output=True)
-    keypoints, scores, valid_frames = h36m_coco_format(keypoints, scores)
-    
-    # Add conf score to the last dim
-    keypoints = np.concatenate((keypoints, scores[..., None]), axis=-1)
+    if not write_files:
+        return keypoints
 
     output_dir_2d = os.path.join(output_dir, 'input_2D/')
     os.makedirs(output_dir_2d, exist_ok=True)
 
     output_npz = os.path.join(output_dir_2d, 'keypoints.npz')
     np.savez_compressed(output_npz, reconstruction=keypoints)
-
-
-def img2video(video_path, output_dir):
-    cap = cv2.VideoCapture(video_path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS)) + 5
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-
-    names = sorted(glob.glob(os.path.join(output_dir + 'pose/', '*.png')))
-    if len(names) == 0:
-        print("No images found in pose/ directory, skipping img2video.")
-        return
-
-    img = cv2.imread(names[0])
-    size = (img.shape[1], img.shape[0])
-
-    video_name = video_path.split('/')[-1].split('.')[0]
-    videoWrite = cv2.VideoWriter(output_dir + video_name + '.mp4', fourcc, fps, size) 
-
-    for name in names:
-        frame_img = cv2.imread(name)
-        videoWrite.write(frame_img)
-
-    videoWrite.release()
-
-
-def showimage(ax, img):
-    ax.set_xticks([])
-    ax.set_yticks([]) 
-    plt.axis('off')
-    ax.imshow(img)
+    return keypoints
 
 
 def resample(n_frames):
@@ -162,21 +124,63 @@ def turn_into_clips(keypoints):
 
 def flip_data(data, left_joints=[1, 2, 3, 14, 15, 16], right_joints=[4, 5, 6, 11, 12, 13]):
     """
-    data: [N, F, 17, D] or [F, 17, D]
+    data: [N, F, 17, D] or [F, 17, D], numpy array or tensor. Returns a flipped copy.
     """
-    flipped_data = copy.deepcopy(data)
+    order = list(range(data.shape[-2]))
+    for left, right in zip(left_joints, right_joints):
+        order[left], order[right] = right, left
+    flipped_data = data[..., order, :]  # Change orders (advanced indexing already copies)
     flipped_data[..., 0] *= -1  # flip x of all joints
-    flipped_data[..., left_joints + right_joints, :] = flipped_data[..., right_joints + left_joints, :]  # Change orders
     return flipped_data
 
 
-@torch.no_grad()
-def get_pose3D(video_path, output_dir, output_json_path="3d_result.json"):
+# clips shorter than this are still resampled to 243 frames in native_length mode
+MIN_NATIVE_FRAMES = 27
+
+
+def length_model(model, n_frames):
     """
-    メインの3D姿勢推定。CPU版に修正。
+    MotionAGFormer for clips of `n_frames` (< 243) frames, sharing every weight with `model`.
+    Only the temporal GCN BatchNorm1d is per frame; the new one takes the 243-frame statistics at the positions
+    where `resample` would have placed each frame. Cached on the model per length.
+    """
+    cache = model.__dict__.setdefault('_length_models', {})
+    if n_frames in cache:
+        return cache[n_frames]
+
+    positions = torch.from_numpy(np.unique(resample(n_frames), return_index=True)[1])
+
+    # deepcopy the module tree only, parameters and buffers stay shared
+    memo = {id(t): t for t in list(model.parameters()) + list(model.buffers())}
+    memo[id(model.__dict__['_length_models'])] = {}
+    clone = copy.deepcopy(model, memo)
+
+    for module in clone.modules():
+        if isinstance(module, GCN) and module.mode == 'temporal':
+            bn = module.batch_norm
+            new_bn = nn.BatchNorm1d(n_frames, eps=bn.eps, momentum=bn.momentum)
+            new_bn.weight.data = bn.weight.data[positions]
+            new_bn.bias.data = bn.bias.data[positions]
+            new_bn.running_mean = bn.running_mean[positions]
+            new_bn.running_var = bn.running_var[positions]
+            module.batch_norm = new_bn.eval()
+            module.num_nodes = n_frames
+            if not module.use_temporal_similarity:
+                module.adj = module.adj[:n_frames, :n_frames]
+
+    cache[n_frames] = clone
+    return clone
+
+
+def load_pose3D_model(checkpoint_dir='MotionAGFormer/checkpoint', variant='fp32', fused_attention=True):
     """
+    MotionAGFormer-Bを構築してCPUに重みを読み込む
+    variant: fp32 (元の重み) / int8 (quantize_models.py で変換した動的int8量子化版)
+    fused_attention: False なら scaled_dot_product_attention を使わず従来の softmax(q k^T) v で計算する (比較用)
+    """
+    check_variant(variant)
     # parse known args for model config
-    args, _ = argparse.ArgumentParser().parse_known_args()
+    args, _ = argparse.ArgumentParser().parse_known_args([])
     args.n_layers, args.dim_in, args.dim_feat, args.dim_rep, args.dim_out = 16, 3, 128, 512, 3
     args.mlp_ratio, args.act_layer = 4, nn.GELU
     args.attn_drop, args.drop, args.drop_path = 0.0, 0.0, 0.0
@@ -191,8 +195,13 @@ def get_pose3D(video_path, output_dir, output_json_path="3d_result.json"):
     # DataParallelを削除し、CPUで実行
     model = MotionAGFormer(**args)
 
+    if variant == 'int8':
+        fp32_path = os.path.join(checkpoint_dir, 'motionagformer-b-h36m.pth.tr')
+        model = load_pose3D_int8(model, variant_path(fp32_path, variant))
+        return set_fused_attention(model, fused_attention)
+
     # load pretrained (map_location='cpu'を追加)
-    model_path = sorted(glob.glob(os.path.join('MotionAGFormer/checkpoint', 'motionagformer-b-h36m.pth.tr')))[0]
+    model_path = sorted(glob.glob(os.path.join(checkpoint_dir, 'motionagformer-b-h36m.pth.tr')))[0]
     pre_dict = torch.load(model_path, map_location='cpu')
     
     # DataParallelでラップされていたモデルの重みをロードする場合の処理
@@ -207,168 +216,499 @@ def get_pose3D(video_path, output_dir, output_json_path="3d_result.json"):
     
     model.load_state_dict(new_state_dict, strict=True)
     model.eval()
+    return set_fused_attention(model, fused_attention)
 
-    # 2D keypoints 
-    keypoints_file = os.path.join(output_dir, 'input_2D', 'keypoints.npz')
-    keypoints = np.load(keypoints_file, allow_pickle=True)['reconstruction']
 
-    # Clips
-    clips, downsample = turn_into_clips(keypoints)
+# rough CPU memory for one 243-frame sequence in a forward pass of MotionAGFormer-B: the temporal attention
+# scores and their softmax (2 x heads x joints x T x T float32) dominate, plus ~20MB of activations.
+# Upper bound for the fused attention path, which does not keep the whole map
+LIFT_MB_PER_SEQUENCE = (2 * 8 * 17 * 243 * 243 * 4) / 2 ** 20 + 20
+
+
+def lift_batch_size(batch_size, max_memory_mb=None):
+    """number of sequences per forward pass: batch_size, capped by max_memory_mb (at least 1)"""
+    if max_memory_mb is not None:
+        batch_size = min(batch_size, int(max_memory_mb // LIFT_MB_PER_SEQUENCE))
+    return max(1, batch_size)
+
+
+def sliding_windows(n_frames, stride, length=243):
+    """start index of every `length`-frame window, `stride` apart; the last window ends at the last frame"""
+    starts = list(range(0, n_frames - length + 1, stride))
+    if starts[-1] != n_frames - length:
+        starts.append(n_frames - length)
+    return np.asarray(starts)
+
+
+def crossfade_weights(length, overlap):
+    """per-frame weight inside a window: linear ramps over the overlap at both ends, 1 in between"""
+    t = np.arange(length)
+    return np.minimum(np.minimum(t + 1, length - t) / (overlap + 1.), 1.)
+
+
+# flip test-time augmentation: off (1x lifting cost), on (original and flipped passes), batched (both in one pass)
+FLIP_MODES = ('off', 'on', 'batched')
+
+
+@torch.no_grad()
+def lift_clips(clips, model, batch_size=8, max_memory_mb=2048, flip='batched'):
+    """
+    clips: (N, T, 17, 3) normalized 2D inputs
+    The clips (and their flipped copies, see FLIP_MODES) go through the model `lift_batch_size` sequences at a time.
+    Returns the (flip-averaged) output (N, T, 17, 3) as a tensor.
+    """
+    if flip not in FLIP_MODES:
+        raise ValueError(f"Unknown flip mode: {flip} (expected one of {FLIP_MODES})")
+
+    step = lift_batch_size(batch_size, max_memory_mb)
+
+    def forward(data):
+        inputs = torch.from_numpy(data.astype('float32'))
+        return torch.cat([model(inputs[i:i + step]) for i in range(0, len(inputs), step)])
+
+    if flip == 'off':
+        return forward(clips)
+    if flip == 'on':
+        return (forward(clips) + flip_data(forward(flip_data(clips)))) / 2
+
+    outputs = forward(np.concatenate((clips, flip_data(clips))))
+    num_clips = len(clips)
+    return (outputs[:num_clips] + flip_data(outputs[num_clips:])) / 2
+
+
+# camera --> world rotation (quaternion) of the 3D output
+WORLD_ROTATION = np.array([0.1407056450843811, -0.1500701755285263, -0.755240797996521, 0.6223280429840088],
+                          dtype='float32')
+
+
+def to_world(output_3D):
+    """
+    (T, 17, 3) camera coordinates --> world coordinates, floor at z=0 and scaled to max 1 (per frame).
+    All frames are transformed at once; the result is the same as transforming them one by one.
+    """
+    # place hip(0) to origin
+    output_3D[:, 0, :] = 0
+
+    # camera_to_world transform
+    poses_3d = camera_to_world(output_3D, R=WORLD_ROTATION, t=0)
+
+    # min=0, then scale (frames whose max is ~0 are left unscaled)
+    poses_3d[:, :, 2] -= np.min(poses_3d[:, :, 2], axis=1, keepdims=True)
+    scale_val = np.max(poses_3d, axis=(1, 2), keepdims=True)
+    np.divide(poses_3d, scale_val, out=poses_3d, where=scale_val > 1e-6)
+
+    return np.asarray(poses_3d, dtype=np.float32)
+
 
-    cap = cv2.VideoCapture(video_path)
-    video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    print('\nGenerating 2D pose image...')
+@torch.no_grad()
+def lift_pose3D(keypoints, model, img_size, batch_size=8, max_memory_mb=2048, window_stride=None,
+                window_mode='blend', native_length=False, flip='batched'):
+    """
+    keypoints: (1, T, 17, 3) 2D keypoints + score
+    img_size: (height, width, ...) of the input video
+    batch_size: 243-frame sequences per forward pass (the flipped copies count too), capped by max_memory_mb
+    window_stride: None lifts non-overlapping 243-frame clips (the tail clip is resampled). Otherwise
+                   videos longer than 243 frames are lifted with windows every `window_stride` frames:
+                   - window_mode='blend': overlapping predictions are cross-faded (linear ramps over the overlap)
+                   - window_mode='center': every frame comes from the window whose center is closest, i.e. one
+                     frame per window with stride 1. This is the batch form: only the frames each window owns
+                     are kept, `batch_size` windows at a time. iter_center_pose3D (stream_pose3D) gives the same
+                     frames incrementally, as each window is filled
+    native_length: clips shorter than 243 frames (short videos, the tail chunk) are lifted at their own length
+                   with length_model instead of being resampled to 243 frames
+    flip: flip test-time augmentation, one of FLIP_MODES (off halves the lifting cost)
+    Returns world coordinates with shape (T, 17, 3), floor at z=0 and scaled to max 1.
+    """
+    n_frames = keypoints.shape[1]
+    input_2D = normalize_screen_coordinates(keypoints, w=img_size[1], h=img_size[0])
+
+    if window_stride is None or n_frames <= 243:
+        clips, downsample = turn_into_clips(input_2D)
+
+        tail = None
+        if native_length and downsample is not None and len(downsample) >= MIN_NATIVE_FRAMES:
+            tail = input_2D[:, n_frames - len(downsample):]
+            clips = clips[:-1]
+
+        output_3D = []
+        if clips:
+            output_3D = list(lift_clips(np.concatenate(clips), model, batch_size, max_memory_mb, flip).cpu().numpy())
+
+        if tail is not None:
+            # a 243-frame video is already the model's native length
+            tail_model = model if tail.shape[1] == 243 else length_model(model, tail.shape[1])
+            output_3D.append(lift_clips(tail, tail_model, batch_size, max_memory_mb, flip)[0].cpu().numpy())
+        elif downsample is not None:
+            # handle re-sample
+            output_3D[-1] = output_3D[-1][downsample]
+        return to_world(np.concatenate(output_3D))
+
+    if window_mode not in ('blend', 'center'):
+        raise ValueError(f"Unknown window mode: {window_mode}")
+
+    # windows further apart than their length would leave frames uncovered
+    window_stride = min(window_stride, 243)
+    starts = sliding_windows(n_frames, window_stride)
+
+    if window_mode == 'center':
+        frames = np.arange(n_frames)
+        centers = starts + 243 // 2
+        right = np.clip(np.searchsorted(centers, frames), 0, len(starts) - 1)
+        left = np.clip(right - 1, 0, None)
+        owner = np.where(np.abs(centers[left] - frames) <= np.abs(centers[right] - frames), left, right)
+
+        output_3D = np.empty((n_frames, 17, 3), dtype=np.float32)
+        step = lift_batch_size(batch_size, max_memory_mb)
+        for first in range(0, len(starts), step):
+            group = starts[first:first + step]
+            windows = np.stack([input_2D[0, start:start + 243] for start in group])
+            outputs = lift_clips(windows, model, batch_size, max_memory_mb, flip).cpu().numpy()
+            owned = np.flatnonzero((owner >= first) & (owner < first + len(group)))
+            output_3D[owned] = outputs[owner[owned] - first, owned - starts[owner[owned]]]
+        return to_world(output_3D)
+
+    windows = np.stack([input_2D[0, start:start + 243] for start in starts])
+    output_3D = lift_clips(windows, model, batch_size, max_memory_mb, flip).cpu().numpy()
+
+    weights = crossfade_weights(243, 243 - window_stride).astype(np.float32)
+    blended = np.zeros((n_frames, 17, 3), dtype=np.float32)
+    weight_sum = np.zeros(n_frames, dtype=np.float32)
+    for start, output in zip(starts, output_3D):
+        blended[start:start + 243] += weights[:, None, None] * output
+        weight_sum[start:start + 243] += weights
+    return to_world(blended / weight_sum[:, None, None])
 
-    output_dir_2D = os.path.join(output_dir, 'pose2D')
-    os.makedirs(output_dir_2D, exist_ok=True)
 
-    for i in tqdm(range(video_length)):
-        ret, img = cap.read()
-        if img is None:
+@torch.no_grad()
+def iter_center_pose3D(keypoints, model, img_size, window_stride=1, batch_size=8, max_memory_mb=2048,
+                       native_length=False, flip='batched', window_mode='center'):
+    """
+    Incremental lift_pose3D(..., window_mode='center') for streams of frames.
+    keypoints: iterable of (17, 3) 2D keypoints + score, one per frame
+    Every `window_stride` frames the 243-frame window ending at the newest frame is lifted, and the frames that
+    belong to it (up to its center) are yielded right away as world coordinates (n, 17, 3), i.e. with
+    121 + window_stride frames of look-ahead. Only the last 243 input frames and one window output are kept.
+    The frames are the same as lift_pose3D with window_mode='center' on the whole sequence (streams of up to
+    243 frames are lifted as a whole at the end, like lift_pose3D does).
+    """
+    if window_mode != 'center':
+        raise ValueError(f"iter_center_pose3D only supports window_mode='center', got {window_mode}")
+    window_stride = min(window_stride, 243)
+    lift_options = dict(batch_size=batch_size, max_memory_mb=max_memory_mb, flip=flip)
+    recent = deque(maxlen=243)
+
+    def lift_window():
+        window = normalize_screen_coordinates(np.array(recent, dtype=np.float32), w=img_size[1], h=img_size[0])
+        return lift_clips(window[None], model, **lift_options)[0].cpu().numpy()
+
+    n_frames = 0
+    previous = None  # (start, output) of the last window lifted on the regular grid
+    emitted = 0
+    for frame in keypoints:
+        recent.append(frame)
+        n_frames += 1
+        start = n_frames - 243
+        if start < 0 or start % window_stride:
             continue
 
-        input_2D = keypoints[0][i]  # single frame
-        overlay_img = show2Dpose(input_2D, copy.deepcopy(img))
-        cv2.imwrite(os.path.join(output_dir_2D, f"{i:04d}_2D.png"), overlay_img)
-    
-    print('\nGenerating 3D pose...')
-
-    output_dir_3D = os.path.join(output_dir, 'pose3D')
-    os.makedirs(output_dir_3D, exist_ok=True)
-
-    all_3d_coords = []
-    idx_offset = 0
-    ret, temp_img = cap.read()  # read 1 frame to get shape
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # reset position
-    img_size = temp_img.shape if temp_img is not None else (1080,1920,3)
-
-    for idx, clip in enumerate(clips):
-        input_2D = normalize_screen_coordinates(clip, w=img_size[1], h=img_size[0]) 
-        input_2D_aug = flip_data(input_2D)
-        
-        # .cuda()を削除し、CPU用に変換
-        input_2D = torch.from_numpy(input_2D.astype('float32'))
-        input_2D_aug = torch.from_numpy(input_2D_aug.astype('float32'))
-
-        output_3D_non_flip = model(input_2D) 
-        output_3D_flip = flip_data(model(input_2D_aug))
-        output_3D = (output_3D_non_flip + output_3D_flip) / 2
-
-        # handle re-sample
-        if idx == len(clips) - 1 and downsample is not None:
-            output_3D = output_3D[:, downsample]
-
-        # place hip(0) to origin
-        output_3D[:, :, 0, :] = 0
-        post_out_all = output_3D[0].cpu().detach().numpy()  # CPU版でも.cpu()は残しておく（互換性のため）
-
-        for j, post_out in enumerate(post_out_all):
-            frame_index = idx_offset + j
-            # camera_to_world transform
-            rot = [0.1407056450843811, -0.1500701755285263, -0.755240797996521, 0.6223280429840088]
-            rot = np.array(rot, dtype='float32')
-            post_out = camera_to_world(post_out, R=rot, t=0)
-
-            # min=0, then scale
-            post_out[:, 2] -= np.min(post_out[:, 2])
-            scale_val = np.max(post_out)
-            if scale_val > 1e-6:
-                post_out /= scale_val
-
-            coords_list = post_out.tolist()
-
-            all_3d_coords.append({
-                "frame_index": frame_index,
-                "coordinates": coords_list
-            })
-
-            # 3D visualize
-            fig = plt.figure(figsize=(9.6, 5.4))
-            gs = gridspec.GridSpec(1, 1)
-            gs.update(wspace=-0.00, hspace=0.05)
-            ax = plt.subplot(gs[0], projection='3d')
-            show3Dpose(post_out, ax)
-            plt.savefig(os.path.join(output_dir_3D, f"{frame_index:04d}_3D.png"),
-                        dpi=200, format='png', bbox_inches='tight')
-            plt.close(fig)
-
-        idx_offset += len(post_out_all)
-        
-    print('Generating 3D pose successful!')
+        output = lift_window()
+        center = start + 243 // 2
+        if previous is None:
+            yield to_world(output[:center + 1].copy())
+        else:
+            # frames up to the midpoint of the two centers belong to the previous window (ties go left)
+            previous_start, previous_output = previous
+            middle = (previous_start + 243 // 2 + center) // 2
+            yield to_world(np.concatenate((previous_output[emitted - previous_start:middle + 1 - previous_start],
+                                           output[middle + 1 - start:center + 1 - start])))
+        previous = (start, output)
+        emitted = center + 1
+
+    if previous is None:
+        if n_frames:
+            yield lift_pose3D(np.array(recent, dtype=np.float32)[None], model, img_size,
+                              native_length=native_length, **lift_options)
+        return
 
-    # Write JSON
-    final_json = {
-        "video_file": video_path,
-        "total_frames": len(all_3d_coords),
-        "frames": all_3d_coords
-    }
-    with open(os.path.join(output_dir, output_json_path), 'w', encoding='utf-8') as f:
-        json.dump(final_json, f, indent=4)
+    # the last window ends at the last frame (sliding_windows); the rest of the frames come from it
+    previous_start, previous_output = previous
+    start = n_frames - 243
+    if start == previous_start:
+        rest = previous_output[emitted - previous_start:]
+    else:
+        output = lift_window()
+        middle = (previous_start + 243 // 2 + start + 243 // 2) // 2
+        rest = np.concatenate((previous_output[emitted - previous_start:middle + 1 - previous_start],
+                               output[middle + 1 - start:]))
+    if len(rest):
+        yield to_world(rest.copy())
 
-    # さらに標準出力にもJSONを書き出し:
-    print(json.dumps(final_json, ensure_ascii=False, indent=4))
 
-    # create demo video
+def stream_pose3D(video_path, output_path, models=None, model=None, chunk_frames=243 * 8, batch_size=1,
+                  det_batch_size=1, det_stride=1, track_kpts=False, prefetch_depth=32, decode_width=None,
+                  lift_options=None, stats=None, on_chunk=None):
+    """
+    Streaming mode for long videos (e.g. a whole batting-practice session) with a fixed memory ceiling.
+    The 2D keypoints are buffered only up to `chunk_frames` frames (rounded down to whole 243-frame clips);
+    every full chunk is lifted and appended to output_path (.npz, PoseArchiveWriter) right away.
+    The result is identical to estimate_pose2D + lift_pose3D, which also lift non-overlapping 243-frame clips.
+    With lift_options window_stride and window_mode='center' the frames are lifted by iter_center_pose3D
+    instead and written as soon as their window is filled (chunk_frames is not used); blended sliding windows
+    are not supported here.
+    on_chunk: called with every lifted chunk (n, 17, 3) once it is written, e.g. JsonAnalist.StreamingAnalyzer.push
+              to analyze the swing while the rest of the video is still being processed
+    Returns the number of frames written.
+    """
+    lift_options = dict(lift_options or {})
+    center_windows = lift_options.get('window_stride') is not None
+    if center_windows and lift_options.get('window_mode', 'blend') != 'center':
+        raise ValueError("stream_pose3D supports sliding windows with window_mode='center' only")
+    chunk_frames = max(243, chunk_frames - chunk_frames % 243)
+    if model is None:
+        model = load_pose3D_model()
+    if stats is None:
+        stats = {}
+
+    frames = iter_video_kpts(video_path, det_dim=416, num_peroson=1, models=models, batch_size=batch_size,
+                             det_batch_size=det_batch_size, det_stride=det_stride, track_kpts=track_kpts,
+                             prefetch_depth=prefetch_depth, decode_width=decode_width, stats=stats)
+    pending_kpts, pending_scores = [], []
+
+    with PoseArchiveWriter(output_path, video_file=video_path) as writer:
+        def write(poses):
+            writer.write(poses)
+            if on_chunk is not None:
+                on_chunk(poses)
+
+        if center_windows:
+            def h36m_frames():
+                for ii, kpts, scores in frames:
+                    keypoints = h36m_keypoints(kpts[:, None], scores[:, None])
+                    # frames without keypoints stay zero, like inside a chunk
+                    yield keypoints[0, 0] if len(keypoints) else np.zeros((17, 3), dtype=np.float32)
+
+            # the video size is known once the first frame is decoded
+            pending = h36m_frames()
+            first = next(pending, None)
+            if first is not None:
+                for poses in iter_center_pose3D(itertools.chain([first], pending), model,
+                                                stats['info'].img_size, **lift_options):
+                    write(poses)
+        else:
+            def lift(n_frames):
+                keypoints = h36m_keypoints(np.array(pending_kpts[:n_frames]).transpose(1, 0, 2, 3),
+                                           np.array(pending_scores[:n_frames]).transpose(1, 0, 2))
+                del pending_kpts[:n_frames], pending_scores[:n_frames]
+                if len(keypoints):
+                    write(lift_pose3D(keypoints, model, stats['info'].img_size, **lift_options))
+
+            for ii, kpts, scores in frames:
+                pending_kpts.append(kpts)
+                pending_scores.append(scores)
+                if len(pending_kpts) >= chunk_frames:
+                    lift(chunk_frames)
+
+            # the rest is lifted like the tail of a whole video (resampled to 243 or at its native length)
+            if pending_kpts:
+                lift(len(pending_kpts))
+
+        info = stats['info']
+        writer.meta.update(fps=info.fps, width=info.width, height=info.height)
+
+    return writer.num_frames
+
+
+def render_video(video_path, output_dir, keypoints_2d, poses_3d, mode='full', fps=None, panels=None,
+                 panel_size=540):
+    """
+    Render the visualization for `mode` (see RENDER_MODES) straight into an H.264 stream at
+    output_dir/<video name>.mp4, without intermediate images. Returns the mp4 path, or None for the modes
+    that do not render.
+    keypoints_2d: (T, 17, 2+) image coordinates, poses_3d: (T, 17, 3)
+    panels: 2D panels collected by get_pose2D(panels=...); when None the video is decoded here
+    """
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: {mode} (expected one of {RENDER_MODES})")
+    if mode in ('none', 'json-only'):
+        return None
+
+    if fps is None:
+        fps = VideoInfo.probe(video_path).fps
+    fps = int(fps) + 5
+
+    video_name = video_path.split('/')[-1].split('.')[0]
+    output_path = os.path.join(output_dir, video_name + '.mp4')
+    os.makedirs(output_dir, exist_ok=True)
+
     print('\nGenerating demo...')
-    image_2d_dir = sorted(glob.glob(os.path.join(output_dir_2D, '*.png')))
-    image_3d_dir = sorted(glob.glob(os.path.join(output_dir_3D, '*.png')))
+    with DemoCompositor(output_path, fps, panel_size=panel_size, mode=mode, poses_3d=poses_3d) as compositor:
+        if panels is not None:
+            for i in tqdm(sorted(panels)):
+                if i < len(poses_3d):
+                    compositor.write(cv2.imdecode(panels[i], cv2.IMREAD_COLOR), i)
+        else:
+            # decode in the background while the frames are composed and encoded
+            with FramePrefetcher(video_path) as reader:
+                for i, img in tqdm(reader, total=reader.num_frames):
+                    if i < len(poses_3d):
+                        compositor.write(panel_2d(keypoints_2d[i], img, panel_size), i)
 
-    output_dir_pose = os.path.join(output_dir, 'pose')
-    os.makedirs(output_dir_pose, exist_ok=True)
+    return output_path
 
-    for i in tqdm(range(len(image_2d_dir))):
-        image_2d = plt.imread(image_2d_dir[i])
-        image_3d = plt.imread(image_3d_dir[i])
 
-        # Crop example
-        if image_2d.shape[0] < image_2d.shape[1]:
-            edge = (image_2d.shape[1] - image_2d.shape[0]) // 2
-            image_2d = image_2d[:, edge:(image_2d.shape[1] - edge)]
+def get_pose3D(video_path, output_dir, output_path="3d_result.npz", output_json_path=None, model=None, info=None,
+               write_files=True, lift_options=None, keypoints=None):
+    """
+    メインの3D姿勢推定。CPU版に修正。
+    keypoints: get_pose2D の戻り値 (1, T, 17, 3)。None の場合のみ input_2D/keypoints.npz から読み込む
+    info: get_pose2D で取得済みの VideoInfo (あれば画像サイズのために動画を開き直さない)
+    lift_options: lift_pose3D に渡すオプション (batch_size, max_memory_mb, window_stride, window_mode, native_length,
+                  flip)
+    output_path: 3D座標の .npz (lib.pose_io.save_poses, load_poses でメモリマップして読める)
+    output_json_path: 指定した場合のみ JSON も書き出す
+    write_files: False (render none) ならファイルは書かない
+    戻り値: (T, 17, 3) の3D座標。可視化は render_video で行う
+    """
+    if model is None:
+        model = load_pose3D_model()
 
-        # 3D image crop
-        edge = 130
-        if image_3d.shape[0] > edge*2 and image_3d.shape[1] > edge*2:
-            image_3d = image_3d[edge:image_3d.shape[0] - edge,
-                                 edge:image_3d.shape[1] - edge]
+    # 2D keypoints 
+    if keypoints is None:
+        keypoints_file = os.path.join(output_dir, 'input_2D', 'keypoints.npz')
+        keypoints = np.load(keypoints_file, allow_pickle=True)['reconstruction']
 
-        fig = plt.figure(figsize=(15.0, 5.4))
-        ax = plt.subplot(121)
-        showimage(ax, image_2d)
-        ax.set_title("Input", fontsize=12)
+    if info is not None:
+        img_size = info.img_size
+    else:
+        cap = cv2.VideoCapture(video_path)
+        ret, temp_img = cap.read()  # read 1 frame to get shape
+        cap.release()
+        img_size = temp_img.shape if temp_img is not None else (1080,1920,3)
 
-        ax = plt.subplot(122)
-        showimage(ax, image_3d)
-        ax.set_title("Reconstruction", fontsize=12)
+    poses_3d = lift_pose3D(keypoints, model, img_size, **(lift_options or {}))
+    print('Generating 3D pose successful!')
 
-        plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
-        plt.margins(0, 0)
+    if write_files:
+        meta = dict(video_file=video_path)
+        if info is not None:
+            meta.update(fps=info.fps, width=info.width, height=info.height)
+        output_path = save_poses(os.path.join(output_dir, output_path), poses_3d, **meta)
+        print(f'3D poses ({len(poses_3d)} frames) --> {output_path}')
+        if output_json_path:
+            export_json(poses_3d, os.path.join(output_dir, output_json_path), video_path)
 
-        plt.savefig(os.path.join(output_dir_pose, f"{i:04d}_pose.png"),
-                    dpi=200, bbox_inches='tight')
-        plt.close(fig)
+    return poses_3d
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--video', type=str, default='sample_video.mp4', help='Path to input video')
     # --gpuオプションは削除（CPU版では不要）
-    parser.add_argument('--out_json', type=str, default='3d_result.json', help='Output JSON file name')
+    parser.add_argument('--out', type=str, default='3d_result.npz', help='Output file name of the 3D poses (.npz)')
+    parser.add_argument('--out_json', type=str, default=None, help='Also export the 3D poses to this JSON file')
+    parser.add_argument('--result_fd', type=int, default=None,
+                        help='Send the 3D poses to this inherited file descriptor (pipe) as one length-prefixed '
+                             'binary message (lib.pose_io.read_result); stdout only carries logs')
+    parser.add_argument('--hrnet_batch', type=int, default=8, help='HRNet patches per forward pass')
+    parser.add_argument('--det_batch', type=int, default=4, help='YOLOv3 frames per forward pass')
+    parser.add_argument('--det_stride', type=int, default=1, help='Run YOLOv3 every N frames (Kalman in between)')
+    parser.add_argument('--track_kpts', action='store_true',
+                        help='Single-person mode: derive each crop from the previous keypoints')
+    parser.add_argument('--prefetch', type=int, default=32, help='Frames decoded ahead in a background thread')
+    parser.add_argument('--decode_width', type=int, default=None, help='Downscale frames to this width on decode')
+    parser.add_argument('--render', type=str, default='full', choices=RENDER_MODES,
+                        help='none / json-only skip all visualization, preview renders the 2D overlay video only. '
+                             'none writes no files (with --stream the result file is still written)')
+    parser.add_argument('--panel_mem', type=int, default=256,
+                        help='MB of 2D panels kept in memory between the 2D pass and rendering (the rest spills '
+                             'to a temporary file)')
+    parser.add_argument('--lift_batch', type=int, default=8, help='MotionAGFormer sequences per forward pass')
+    parser.add_argument('--lift_max_mem', type=int, default=2048, help='Memory cap (MB) for one lifting batch')
+    parser.add_argument('--lift_stride', type=int, default=None,
+                        help='Sliding-window lifting: window step in frames (default: 243-frame chunks)')
+    parser.add_argument('--lift_window', type=str, default='blend', choices=('blend', 'center'),
+                        help='blend: cross-fade overlapping windows, center: each frame from the window centred closest to it '
+                             '(with --stream, written as each window is filled)')
+    parser.add_argument('--lift_native', action='store_true',
+                        help='Lift clips shorter than 243 frames at their own length instead of resampling them')
+    parser.add_argument('--flip', type=str, default='batched', choices=FLIP_MODES,
+                        help='Flip test-time augmentation: off (2x faster lifting), on, batched')
+    parser.add_argument('--hrnet_variant', type=str, default='fp32', choices=MODEL_VARIANTS,
+                        help='HRNet weights: fp32 or int8 (converted by quantize_models.py)')
+    parser.add_argument('--lift_variant', type=str, default='fp32', choices=MODEL_VARIANTS,
+                        help='MotionAGFormer weights: fp32 or int8 (converted by quantize_models.py)')
+    parser.add_argument('--lift_explicit_attention', action='store_true',
+                        help='Compute attention as softmax(q k^T) v instead of scaled_dot_product_attention')
+    parser.add_argument('--stream', action='store_true',
+                        help='Long videos: lift in chunks and append to the result as it goes (bounded memory)')
+    parser.add_argument('--stream_chunk', type=int, default=243 * 8,
+                        help='Frames buffered per chunk in --stream mode (rounded down to multiples of 243)')
     args = parser.parse_args()
+    if args.stream and args.render in ('preview', 'full'):
+        print(f'--stream writes the 3D poses only, the {args.render} video is not rendered.')
+    if args.stream and args.lift_stride is not None and args.lift_window != 'center':
+        parser.error('--stream supports --lift_stride with --lift_window center only')
 
     # CUDA環境変数の設定を削除
 
     video_path = args.video
     video_name = os.path.splitext(os.path.basename(video_path))[0]
     output_dir = f'./run/output/{video_name}/'
-    os.makedirs(output_dir, exist_ok=True)
-
-    # 1) 2D keypoints extraction
-    get_pose2D(video_path, output_dir)
-
-    # 2) 3D pose estimation + JSON output
-    get_pose3D(video_path, output_dir, output_json_path=args.out_json)
-
-    # 3) 2D/3D combined video
-    img2video(video_path, output_dir)
-
-    print('Generating demo successful!')
+    write_files = args.stream or args.render != 'none'
+    if write_files:
+        os.makedirs(output_dir, exist_ok=True)
+
+    lift_options = dict(batch_size=args.lift_batch, max_memory_mb=args.lift_max_mem, window_stride=args.lift_stride,
+                        window_mode=args.lift_window, native_length=args.lift_native, flip=args.flip)
+    model_3D = load_pose3D_model(variant=args.lift_variant, fused_attention=not args.lift_explicit_attention)
+
+    if args.stream:
+        # 2D推定 -> 持ち上げ -> 結果の追記 をチャンクごとに行い、動画の長さによらずメモリを一定に保つ
+        models_2D = load_models_2D(det_dim=416, argv=[], variant=args.hrnet_variant)
+        output_path = os.path.join(output_dir, args.out)
+        num_frames = stream_pose3D(video_path, output_path, models=models_2D, model=model_3D,
+                                   chunk_frames=args.stream_chunk, batch_size=args.hrnet_batch,
+                                   det_batch_size=args.det_batch, det_stride=args.det_stride,
+                                   track_kpts=args.track_kpts, prefetch_depth=args.prefetch,
+                                   decode_width=args.decode_width, lift_options=lift_options)
+        print(f'Generating 3D pose successful! {num_frames} frames --> {output_path}')
+        if args.out_json or args.result_fd is not None:
+            # JSON / 呼び出し元への送信はメモリマップした結果からチャンクごとに行う
+            poses_3d, archive_meta = load_poses(output_path)
+            # 送信するメタデータは非ストリーム時と同じキーに揃える (format / joints はアーカイブ側の情報)
+            meta = {key: archive_meta.get(key) for key in ('video_file', 'fps', 'width', 'height')}
+            if args.out_json:
+                export_json(poses_3d, os.path.join(output_dir, args.out_json), video_path)
+    else:
+        rendering = args.render in ('preview', 'full')
+
+        # 1) 2D keypoints extraction (動画のデコードはここでの1回だけ。描画する場合は2Dパネルも同時に作る)
+        # パネルは --panel_mem MB まではメモリ、超えた分は一時ファイルに置く。描画しないモードでは作らない
+        models_2D = load_models_2D(det_dim=416, argv=[], variant=args.hrnet_variant)
+        stats = {}
+        panels = PanelSpool(args.panel_mem) if rendering else None
+        keypoints = get_pose2D(video_path, output_dir, models=models_2D, batch_size=args.hrnet_batch,
+                               det_batch_size=args.det_batch, det_stride=args.det_stride,
+                               track_kpts=args.track_kpts, prefetch_depth=args.prefetch,
+                               decode_width=args.decode_width, panels=panels, stats=stats,
+                               write_files=write_files)
+        info = stats['info']
+
+        # 2) 3D pose estimation + result file (+ JSON export)
+        poses_3d = get_pose3D(video_path, output_dir, output_path=args.out, output_json_path=args.out_json,
+                              model=model_3D, info=info, write_files=write_files,
+                              lift_options=lift_options, keypoints=keypoints)
+
+        # 3) 2D/3D combined video (preview は2Dオーバーレイのみ)
+        render_video(video_path, output_dir, keypoints[0], poses_3d, mode=args.render, fps=info.fps,
+                     panels=panels)
+        if panels is not None:
+            panels.close()
+
+        print('Generating demo successful!')
+        meta = dict(video_file=video_path, fps=info.fps, width=info.width, height=info.height)
+
+    if args.result_fd is not None:
+        # 結果は標準出力ではなく呼び出し元から渡されたパイプへ送る
+        with os.fdopen(args.result_fd, 'wb') as result_pipe:
+            write_result(result_pipe, poses_3d, **meta)
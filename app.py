@@ -51,6 +51,24 @@ def run_sync(coro):
     finally:
         loop.close()
 
+def pose_progress_display():
+    """長い動画の推定中に、処理済みフレーム数と途中までの解析結果を表示するコールバック (process_video の on_progress)"""
+    widgets = {}
+
+    def on_progress(done, total, snapshot):
+        if not widgets:
+            widgets["bar"] = st.progress(0.0)
+            widgets["status"] = st.empty()
+        widgets["bar"].progress(min(done / total, 1.0) if total else 0.0)
+        text = f"{done} / {total} フレーム処理済み"
+        if snapshot["speed"] is not None:
+            text += f" ・ 暫定の最大バットスピード: {snapshot['speed']:.1f} (フレーム {snapshot['max_speed_index']})"
+        in_zone = sum(bool(judge) for judge in snapshot["judge"])
+        text += f" ・ ストライクゾーン内: {in_zone} フレーム"
+        widgets["status"].caption(text)
+
+    return on_progress
+
 def save_temp_file(uploaded_file, prefix):
     """一時ファイルとしてアップロードを保存し、そのパスを返す"""
     if not uploaded_file:
@@ -162,7 +180,9 @@ def main():
                 with st.spinner("推定を実行中..."):
                     user_video_path = save_temp_file(user_uploaded_file, "user_video")
                     try:
-                        pose_json_path, vis_video_path, _ = run_sync(system.process_video(user_video_path))
+                        pose_json_path, vis_video_path, _ = run_sync(
+                            system.process_video(user_video_path, on_progress=pose_progress_display())
+                        )
                         st.session_state.user_json_path = pose_json_path
                         st.session_state.visualization_path = vis_video_path
                         st.session_state.pose_estimation_completed = True
@@ -171,7 +191,7 @@ def main():
                         st.error(f"エラー: {e}")
 
         else:  # JSONアップロード
-            user_json_file = st.file_uploader("あなたの3D姿勢データ(JSON)をアップロード", type=["json"])
+            user_json_file = st.file_uploader("あなたの3D姿勢データ(JSON / NPZ)をアップロード", type=["json", "npz"])
             if user_json_file:
                 if not validate_inputs(basic_info, coaching_policy):
                     st.stop()
@@ -189,19 +209,35 @@ def main():
                     ideal_temp_path = save_temp_file(ideal_vid, "ideal_video")
                     with st.spinner("理想スイング推定..."):
                         try:
-                            pose_json_path, vis_video_path, _ = run_sync(system.process_video(ideal_temp_path))
+                            pose_json_path, vis_video_path, _ = run_sync(
+                                system.process_video(ideal_temp_path, on_progress=pose_progress_display())
+                            )
                             st.session_state.ideal_json_path = pose_json_path
                             st.session_state.ideal_visualization_path = vis_video_path
                             st.success("理想スイング推定完了。")
                         except Exception as e:
                             st.error(f"エラー: {e}")
             elif ideal_type == "3D姿勢JSON":
-                ideal_json = st.file_uploader("理想3D姿勢JSON", type=["json"], key="ideal_json")
+                ideal_json = st.file_uploader("理想3D姿勢JSON", type=["json", "npz"], key="ideal_json")
                 if ideal_json:
                     ideal_json_path = save_temp_file(ideal_json, "ideal_pose")
                     st.session_state.ideal_json_path = ideal_json_path
                     st.success("理想JSONを登録しました。")
 
+        # 可視化動画は要求された時だけ生成する
+        if (not st.session_state.visualization_path
+                and system.can_render_visualization(st.session_state.user_json_path)):
+            render_mode = st.radio("可視化の種類", ["full", "preview"], horizontal=True,
+                                   format_func=lambda m: "2D + 3D" if m == "full" else "2Dのみ (高速)")
+            if st.button("解析結果の動画を生成"):
+                with st.spinner("動画を生成中..."):
+                    try:
+                        st.session_state.visualization_path = run_sync(
+                            system.render_visualization(st.session_state.user_json_path, render_mode)
+                        )
+                    except Exception as e:
+                        st.error(f"エラー: {e}")
+
         # 生成された動画のプレビュー
         if st.session_state.visualization_path:
             st.write("### 解析結果のスイング動画プレビュー")
@@ -1,7 +1,5 @@
 from typing import Dict, Any, Optional
 import os
-import json
-import asyncio
 from langchain_google_genai import ChatGoogleGenerativeAI
 from agents import (
     InteractiveAgent,
@@ -13,6 +11,7 @@ from agents import (
 )
 from core.base.logger import SystemLogger
 from core.base.state import create_initial_state, SystemState
+from MotionAGFormer.run.pose_service import PoseEstimationService
 
 class SwingCoachingSystem:
     def __init__(self, config: Dict[str, Any]):
@@ -31,6 +30,9 @@ class SwingCoachingSystem:
             convert_system_message_to_human=True
         )
 
+        # 姿勢推定サービス (ModelingAgentと共有)
+        self.pose_service = PoseEstimationService.shared(**config.get("pose_estimation", {}))
+
         # エージェントの初期化
         self.agents = {
             "interactive": InteractiveAgent(self.llm, mode="cli"),
@@ -140,41 +142,3 @@ class SwingCoachingSystem:
         except Exception as e:
             self.logger.log_error_details(error=e, agent="system")
             raise
-
-    async def _estimate_3d_pose(self, video_path: str) -> Dict[str, Any]:
-        """3D姿勢推定を実行"""
-        try:
-            cmd = [
-                "python",
-                "MotionAGFormer/run/vis.py",
-                "--video", video_path
-            ]
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-
-            stdout_str = stdout.decode()
-            stderr_str = stderr.decode()
-
-            self.logger.log_debug(f"Pose estimation stdout: {stdout_str}")
-            if stderr_str:
-                self.logger.log_warning(f"Pose estimation stderr: {stderr_str}")
-
-            # JSONデータの抽出
-            try:
-                json_start = stdout_str.find('{')
-                json_end = stdout_str.rfind('}') + 1
-                if json_start >= 0 and json_end > 0:
-                    json_str = stdout_str[json_start:json_end]
-                    return json.loads(json_str)
-                return {}
-            except json.JSONDecodeError as e:
-                self.logger.log_error(f"JSON decode error: {e}")
-                return {}
-
-        except Exception as e:
-            self.logger.log_error_details(error=e, agent="system")
-            raise
\ No newline at end of file
@@ -14,7 +14,7 @@ class VideoDisplay:
         """
         動画をWebUI表示用に準備
         1. 動画のフォーマット確認
-        2. 必要に応じて変換
+        2. 必要に応じて変換 (既にH.264ならコピーのみ)
         3. 表示用の一時パスを返す
         """
         if not os.path.exists(video_path):
@@ -33,8 +33,14 @@ class VideoDisplay:
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             fps = int(cap.get(cv2.CAP_PROP_FPS))
+            fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little').decode('ascii', errors='ignore')
             cap.release()
 
+            # DemoCompositor が出力する動画は既にH.264 (faststart) なので再エンコードしない
+            if fourcc.lower() in ('avc1', 'h264'):
+                shutil.copyfile(video_path, display_path)
+                return display_path
+
             # 動画の変換（必要に応じて）
             # Streamlit対応のため、H.264コーデックを使用
             cmd = [
@@ -1,12 +1,15 @@
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Callable
 import os
 import asyncio
-import json
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 from core.base.logger import SystemLogger
 from core.webui.state import WebUIState
 from core.webui.media import VideoDisplay
+from MotionAGFormer.run.pose_service import PoseEstimationService
+from MotionAGFormer.run.lib.pose_io import load_poses, export_json
+from MotionAGFormer.run.lib.prefetch import VideoInfo
+from MotionAGFormer.JsonAnalist import StreamingAnalyzer
 from agents import (
     InteractiveAgent,
     ModelingAgent,
@@ -17,10 +20,23 @@ from agents import (
 )
 
 class WebUISwingCoachingSystem:
+    # Streamlit は再実行のたびにインスタンスを作り直すため、描画に使う推定結果はクラス側で保持する
+    # pose_path -> (PoseResult, output_dir)。_max_pose_results 件を超えたら古いものから捨てる。
+    # render_mode が none の場合は描画しないので保持しない
+    _pose_results = {}
+    _max_pose_results = 8
+    # 長い動画の推定中に途中経過 (on_progress) を確認する間隔 [秒]
+    progress_interval = 1.0
+
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.logger = SystemLogger()
         self.video_display = VideoDisplay()
+        self.pose_service = PoseEstimationService.shared(**config.get("pose_estimation", {}))
+        # process_video 時の描画モード。json-only なら動画は render_visualization で必要な時だけ作る
+        self.render_mode = config.get("visualization", {}).get("render_mode", "json-only")
+        # 3D座標は .npz で保存する。true なら visualization_data.json も書き出す
+        self.export_json = config.get("visualization", {}).get("export_json", False)
         self.interactive_enabled = True
 
         # LLMの初期化
@@ -52,11 +68,22 @@ class WebUISwingCoachingSystem:
         # PlanAgentの初期化
         self.agents["plan"] = PlanAgent(self.llm, self.agents["search"])
 
-    async def process_video(self, video_path: str) -> Tuple[str, str, str]:
+    async def process_video(
+        self,
+        video_path: str,
+        on_progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+    ) -> Tuple[str, str, str]:
         """
         動画処理を実行し、3D姿勢推定結果とビジュアライゼーション動画を返す
+        on_progress: 長い動画 (チャンクごとの推定) の途中経過を受け取るコールバック
+                     (処理済みフレーム数, 総フレーム数, StreamingAnalyzer.snapshot())。
+                     推定スレッドではなく呼び出し元のイベントループから呼ばれるので、Streamlit の表示を直接更新してよい
         Returns:
-            Tuple[str, str, str]: (pose_json_path, visualization_video_path, visualization_json_path)
+            Tuple[str, str, str]: (pose_path, visualization_video_path, visualization_json_path)
+            pose_path は 3d_result.npz (lib.pose_io.load_poses で読む)
+            render_mode が none / json-only の場合 visualization_video_path は None
+            3d_result.npz は解析 (ModelingAgent) の入力なので render_mode によらず書き出す
+            export_json が false の場合 visualization_json_path は None
         """
         try:
             # 動画名から出力ディレクトリを設定
@@ -64,47 +91,84 @@ class WebUISwingCoachingSystem:
             output_dir = f'./run/output/{video_name}/'
             os.makedirs(output_dir, exist_ok=True)
             
-            # 出力JSONのパス
-            pose_json_path = os.path.join(output_dir, "3d_result.json")
-
-            # MotionAGFormerの実行
-            cmd = [
-                "python",
-                "MotionAGFormer/run/vis.py",
-                "--video", video_path,
-            ]
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+            # 出力 (.npz) のパス
+            pose_path = os.path.join(output_dir, "3d_result.npz")
+
+            # MotionAGFormerの実行 (モデルは常駐サービスで使い回す)
+            self._pose_results.pop(pose_path, None)
+            if self.pose_service.should_stream(video_path):
+                # 長い動画はチャンクごとに追記し、結果全体をメモリに持たない (可視化動画は作れない)
+                await self._estimate_to_file(video_path, pose_path, on_progress)
+            else:
+                result = await self.pose_service.estimate(video_path)
+                result.save(pose_path)
+                if self.render_mode != "none":
+                    # json-only では後から render_visualization で描画できるよう結果を残す
+                    self._pose_results[pose_path] = (result, output_dir)
+                    while len(self._pose_results) > self._max_pose_results:
+                        self._pose_results.pop(next(iter(self._pose_results)))
+
+            vis_json_path = None
+            if self.export_json:
+                # 保存した結果をメモリマップで読み、JSONへ書き出す
+                vis_json_path = os.path.join(output_dir, "visualization_data.json")
+                export_json(load_poses(pose_path)[0], vis_json_path, video_path, named_joints=True)
+
+            display_video_path = None
+            if self.render_mode in ("preview", "full") and self.can_render_visualization(pose_path):
+                display_video_path = await self.render_visualization(pose_path, self.render_mode)
+
+            return pose_path, display_video_path, vis_json_path
+
+        except Exception as e:
+            self.logger.log_error_details(error=e, agent="system")
+            raise
 
-            if stderr:
-                self.logger.log_warning(f"Pose estimation stderr: {stderr.decode()}")
+    async def _estimate_to_file(self, video_path: str, pose_path: str, on_progress=None) -> None:
+        """estimate_to_file の各チャンクを StreamingAnalyzer で解析し、途中経過を on_progress へ渡す"""
+        if on_progress is None:
+            await self.pose_service.estimate_to_file(video_path, pose_path)
+            return
 
-            if process.returncode != 0:
-                raise RuntimeError(f"Pose estimation failed: {stderr.decode()}")
+        analyzer = StreamingAnalyzer()
+        total_frames = VideoInfo.probe(video_path).num_frames
+        # push は推定スレッドから呼ばれる。snapshot はここ (イベントループ側) で取る
+        task = asyncio.ensure_future(
+            self.pose_service.estimate_to_file(video_path, pose_path, on_chunk=analyzer.push)
+        )
+        reported = 0
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self.progress_interval)
+            if analyzer.num_frames != reported:
+                reported = analyzer.num_frames
+                on_progress(reported, total_frames, analyzer.snapshot())
+            if done:
+                break
+        await task
 
-            # vis.pyの出力規則に従ってパスを設定
-            vis_video_path = os.path.join(output_dir, f"{video_name}.mp4")
-            vis_json_path = os.path.join(output_dir, "visualization_data.json")
+    def can_render_visualization(self, pose_path: Optional[str]) -> bool:
+        """
+        process_video で推定し、描画用に保持している結果か
+        (アップロードされたファイル、長い動画、render_mode none の結果からは動画を作れない)
+        """
+        return pose_path in self._pose_results
 
-            # 結果のJSONをvisualization_data.jsonにコピー
-            if os.path.exists(pose_json_path):
-                with open(pose_json_path, 'r') as f:
-                    vis_data = json.load(f)
-                with open(vis_json_path, 'w') as f:
-                    json.dump(vis_data, f, indent=4)
+    async def render_visualization(self, pose_path: str, mode: str = "full") -> str:
+        """
+        process_video 済みの結果から可視化動画を生成し、表示用の動画パスを返す
+        mode: preview (2Dオーバーレイのみ) / full (2D入力 + 3D再構成)
+        """
+        try:
+            if pose_path not in self._pose_results:
+                raise KeyError(f"No pose estimation result for: {pose_path}")
+            result, output_dir = self._pose_results[pose_path]
 
-            if not os.path.exists(vis_video_path):
+            vis_video_path = await self.pose_service.render(result, output_dir, mode=mode)
+            if not vis_video_path or not os.path.exists(vis_video_path):
                 raise FileNotFoundError(f"Visualization video not generated: {vis_video_path}")
 
             # 表示用の動画パスを生成
-            display_video_path = self.video_display.prepare_video_display(vis_video_path)
-
-            return pose_json_path, display_video_path, vis_json_path
+            return self.video_display.prepare_video_display(vis_video_path)
 
         except Exception as e:
             self.logger.log_error_details(error=e, agent="system")
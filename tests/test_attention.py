@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from MotionAGFormer.model.MotionAGFormer import MotionAGFormer
+from MotionAGFormer.model.modules.attention import Attention, set_fused_attention
+
+
+@pytest.mark.parametrize('mode', ['spatial', 'temporal'])
+def test_fused_attention_matches_explicit_attention(mode):
+    torch.manual_seed(0)
+    attention = Attention(32, 32, num_heads=4, mode=mode).eval()
+    x = torch.randn(2, 27, 17, 32)
+
+    with torch.no_grad():
+        fused = attention(x)
+        attention.fused = False
+        explicit = attention(x)
+
+    assert torch.allclose(fused, explicit, atol=1e-5)
+
+
+def test_set_fused_attention_keeps_the_model_output():
+    torch.manual_seed(0)
+    model = MotionAGFormer(n_layers=2, dim_in=3, dim_feat=32, dim_rep=64, n_frames=27).eval()
+    x = torch.randn(1, 27, 17, 3)
+
+    with torch.no_grad():
+        fused = set_fused_attention(model, True)(x)
+        explicit = set_fused_attention(model, False)(x)
+
+    assert all(not module.fused for module in model.modules() if isinstance(module, Attention))
+    assert torch.allclose(fused, explicit, atol=1e-5)
+
+
+def test_dropout_in_training_takes_the_explicit_path():
+    attention = Attention(32, 32, num_heads=4, attn_drop=0.1).train()
+    assert not attention.use_fused()
+    assert attention.eval().use_fused()
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'MotionAGFormer', 'run'))
+from lib.compositor import PanelSpool, crop_square, panel_2d
+
+
+def test_portrait_panel_keeps_the_aspect_ratio():
+    # 640x360 portrait frame with a centered black square of 180 px, no keypoints drawn on it
+    frame = np.full((640, 360, 3), 200, dtype=np.uint8)
+    frame[230:410, 90:270] = 0
+    kpts = np.full((17, 2), -100.)
+
+    panel = panel_2d(kpts, frame, 320)
+    assert panel.shape == (320, 320, 3)
+
+    # the frame fills the height and is padded with white at the sides
+    rows, cols = np.nonzero(panel.min(axis=2) < 100)
+    height, width = rows.max() - rows.min() + 1, cols.max() - cols.min() + 1
+    assert abs(height - width) <= 2
+    assert abs(height - 90) <= 2
+    assert (panel[:, :60] == 255).all() and (panel[:, -60:] == 255).all()
+
+
+def test_landscape_frame_is_center_cropped():
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    frame[:, 140:500] = 255
+    square = crop_square(frame)
+    assert square.shape == (360, 360, 3)
+    assert (square == 255).all()
+
+
+def test_panel_spool_spills_to_disk_and_reads_back():
+    panels = {i: np.random.RandomState(i).randint(0, 256, 1000 + i, dtype=np.uint8) for i in range(50)}
+    with PanelSpool(max_memory_mb=0.01) as spool:
+        for i, data in panels.items():
+            spool[i] = data
+        assert spool._file._rolled
+        assert len(spool) == 50 and sorted(spool) == list(range(50))
+        for i in (49, 0, 17):
+            np.testing.assert_array_equal(spool[i], panels[i])
@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'MotionAGFormer', 'run'))
+from lib.pose_io import load_poses, read_result, save_poses, write_result
+
+
+def send(poses, **kwargs):
+    """write_result into an os.pipe() from a thread (the pipe buffer is smaller than the message) and read it back"""
+    r, w = os.pipe()
+
+    def writer():
+        with os.fdopen(w, 'wb') as pipe:
+            write_result(pipe, poses, **kwargs)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    with os.fdopen(r, 'rb') as pipe:
+        result = read_result(pipe)
+        assert pipe.read() == b''
+    thread.join()
+    return result
+
+
+def test_result_round_trip_through_a_pipe():
+    poses = np.random.RandomState(0).rand(1000, 17, 3).astype(np.float32)
+    received, meta = send(poses, chunk_size=64, video_file='swing.mp4', fps=30.0, width=1920, height=1080)
+
+    assert received.dtype == np.float32 and received.shape == poses.shape
+    np.testing.assert_array_equal(received, poses)
+    assert meta == dict(video_file='swing.mp4', fps=30.0, width=1920, height=1080)
+
+
+def test_result_from_a_memory_mapped_archive(tmp_path):
+    poses = np.random.RandomState(1).rand(300, 17, 3).astype(np.float32)
+    path = save_poses(str(tmp_path / '3d_result.npz'), poses)
+    mapped, _ = load_poses(path)
+
+    received, _ = send(mapped, chunk_size=100)
+    np.testing.assert_array_equal(received, poses)
+
+
+def test_empty_and_broken_results():
+    received, meta = send(np.zeros((0, 17, 3), dtype=np.float32))
+    assert received.shape == (0, 17, 3) and meta == {}
+
+    message = io.BytesIO()
+    write_result(message, np.ones((10, 17, 3), dtype=np.float32))
+    with pytest.raises(EOFError):
+        read_result(io.BytesIO(message.getvalue()[:-1]))
+    with pytest.raises(ValueError):
+        read_result(io.BytesIO(b'JUNK' + message.getvalue()[4:]))
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'MotionAGFormer', 'run'))
+from lib.sort.sort import Sort
+
+
+# track IDs come from a global counter, so the tests compare them to the ones update() returned
+BOX_A = np.array([[10., 10., 60., 160., 0.9]])
+BOX_B = np.array([[300., 20., 350., 170., 0.9]])
+
+
+def ids(tracks):
+    return tracks[:, -1].tolist()
+
+
+def test_predict_returns_only_trackers_matched_at_last_update():
+    # key frame: A, forced re-detection on the next frame: B only (A is left unmatched but kept alive)
+    sort = Sort()
+    id_a = ids(sort.update(BOX_A))
+    id_b = ids(sort.update(BOX_B))
+    assert len(sort.trackers) == 2 and id_a != id_b
+
+    # propagated frames must keep following B, not the stale tracker of A
+    for _ in range(3):
+        tracks = sort.predict()
+        assert ids(tracks) == id_b
+        np.testing.assert_allclose(tracks[0, :4], BOX_B[0, :4], atol=1.0)
+
+
+def test_predict_is_empty_when_no_tracker_was_matched():
+    sort = Sort()
+    sort.update(BOX_A)
+    sort.update(np.empty((0, 5)))
+
+    assert not sort.tracked()
+    assert sort.predict().shape == (0, 5)
+
+
+def test_key_frames_keep_returning_the_track_between_predictions():
+    # det_stride=3: update on every third frame, predict in between; the track must not drop out on key frames
+    sort = Sort()
+    id_a = ids(sort.update(BOX_A))
+    for frame in range(1, 12):
+        tracks = sort.update(BOX_A) if frame % 3 == 0 else sort.predict()
+        assert ids(tracks) == id_a